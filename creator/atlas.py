@@ -0,0 +1,114 @@
+from math import ceil, sqrt
+
+from PyQt5.QtCore import QRect, Qt
+from PyQt5.QtGui import QImage, QPainter, QPixmap
+
+from grid import Grid
+from images import IMAGE_CACHE
+from profiling import PROFILER
+
+class TileAtlas:
+    '''Tile images packed into one image per zoom level, level n has cells of cell >> n pixels.
+
+    Every image path gets a slot, the same cell of every level. Levels are scaled down
+    from the original images, so drawing at any zoom copies pixels and never scales.
+    Adding a path marks the atlas stale, it is rebuilt the next time it is drawn from.'''
+
+    def __init__(self, cell: int) -> None:
+        self.cell: int = cell
+        self.level_count: int = cell.bit_length()
+        # image path -> slot
+        self.slots: dict[str, int] = {}
+        self.paths: list[str] = []
+        self.columns: int = 1
+        self.levels: list[QImage] = []
+        self.pixmaps: list[QPixmap] = []
+        # per level, rows[r][slot] holds pixel row r of the slot as raw ARGB32 bytes, built on first use
+        self.rows: list[list[list[bytes]]] = []
+        self.stale: bool = True
+
+    def add(self, image_path: str) -> int:
+        '''Slot of the image at image_path, -1 for tiles without an image.'''
+        if image_path is None: return -1
+        result = self.slots.get(image_path)
+        if result is None:
+            result = len(self.paths)
+            self.slots[image_path] = result
+            self.paths += [image_path]
+            self.stale = True
+        return result
+
+    def clear(self):
+        self.slots.clear()
+        self.paths = []
+        self.stale = True
+
+    def level_for(self, hw: int) -> int:
+        '''Smallest level with cells of at least hw pixels.'''
+        level = 0
+        while level + 1 < self.level_count and self.cell >> (level + 1) >= hw:
+            level += 1
+        return level
+
+    def source(self, slot: int, level: int) -> QRect:
+        c = self.cell >> level
+        return QRect(slot % self.columns * c, slot // self.columns * c, c, c)
+
+    def build(self):
+        if not self.stale: return
+        with PROFILER.span('build atlas', images=len(self.paths)):
+            self.columns = max(1, ceil(sqrt(len(self.paths))))
+            rows = max(1, ceil(len(self.paths) / self.columns))
+            originals = [IMAGE_CACHE.get(p).toImage() for p in self.paths]
+            self.levels = []
+            for level in range(self.level_count):
+                c = self.cell >> level
+                image = QImage(self.columns * c, rows * c, QImage.Format_ARGB32_Premultiplied)
+                image.fill(Qt.transparent)
+                painter = QPainter(image)
+                for slot, original in enumerate(originals):
+                    if original.isNull(): continue
+                    # tiles are stretched over their cell like the room view always drew them
+                    scaled = original.scaled(c, c, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+                    painter.drawImage(slot % self.columns * c, slot // self.columns * c, scaled)
+                painter.end()
+                self.levels += [image]
+            self.pixmaps = [QPixmap.fromImage(image) for image in self.levels]
+            self.rows = [None] * self.level_count
+            self.stale = False
+
+    def slot_rows(self, level: int) -> list[list[bytes]]:
+        if self.rows[level] is None:
+            image = self.levels[level]
+            c = self.cell >> level
+            data = image.constBits().asstring(image.byteCount())
+            line = image.bytesPerLine()
+            result = []
+            for r in range(c):
+                row = []
+                for slot in range(len(self.paths)):
+                    start = (slot // self.columns * c + r) * line + slot % self.columns * c * 4
+                    row += [data[start:start + c * 4]]
+                result += [row]
+            self.rows[level] = result
+        return self.rows[level]
+
+    def raster(self, grid: Grid, slots: list[int], level: int, x1: int, y1: int, x2: int, y2: int) -> QImage:
+        '''Image of the cells x1 <= x < x2, y1 <= y < y2 of grid at level.
+
+        slots[code - 1] is the slot of the tile stored as code. Rows are put together
+        from the pixel rows of the slots, which is far cheaper than drawing every cell
+        once cells are only a few pixels wide.'''
+        c = self.cell >> level
+        rows = self.slot_rows(level)
+        blank = bytes(c * 4)
+        code_rows = [[blank] + [rows[r][s] if s >= 0 else blank for s in slots] for r in range(c)]
+        parts = []
+        for y in range(y1, y2):
+            codes = grid.row(y, x1, x2)
+            for r in range(c):
+                parts += [b''.join(map(code_rows[r].__getitem__, codes))]
+        width = (x2 - x1) * c
+        data = b''.join(parts)
+        # copy so the image owns its pixels once data is gone
+        return QImage(data, width, (y2 - y1) * c, width * 4, QImage.Format_ARGB32_Premultiplied).copy()
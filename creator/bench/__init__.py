@@ -0,0 +1,3 @@
+'''Benchmarks for the creator, run from the creator directory with python -m bench.<module>.
+
+All of them are headless, only bench.startup needs Qt and runs the editor on the offscreen platform.'''
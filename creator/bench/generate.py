@@ -0,0 +1,84 @@
+'''Generates reproducible synthetic projects for the benchmarks.
+
+    python -m bench.generate DIR [--rooms N] [--width W] [--height H] [--tiles T] [--scripts S] [--seed SEED]
+'''
+
+import argparse
+import random
+import sys
+
+from game import Game, Room, Tile
+from grid import Rect
+
+def make_tiles(count: int, scripts: int, rng: random.Random) -> list[Tile]:
+    '''count tiles, the first scripts * 2 of them use one of scripts distinct scripts.'''
+    result = []
+    for i in range(count):
+        tile = Tile()
+        tile.name = f'tile{i}'
+        tile.display_name = f'Tile {i}'
+        tile.passable = rng.random() < 0.7
+        tile.seethrough = rng.random() < 0.8
+        tile.image_path = f'Tile{i % 4 + 1}.png'
+        if scripts > 0 and i < scripts * 2:
+            n = i % scripts
+            tile.script = f'function step{n}()\n    print("step {n}")\nend\n\nfunction interact{n}()\n    print("interact {n}")\nend\n'
+            tile.step_func = f'step{n}'
+            tile.interact_func = f'interact{n}'
+        result += [tile]
+    return result
+
+def make_room(name: str, width: int, height: int, tiles: list[Tile], rng: random.Random) -> Room:
+    '''Room floored with its first tile and covered by random rects of the others on about a third of the cells.'''
+    result = Room(width, height)
+    result.name = lambda: name
+    for tile in tiles:
+        result.add_tile(tile)
+    result.fill(Rect(0, 0, width, height), tiles[0])
+    covered = 0
+    while covered < width * height // 3:
+        w = rng.randint(1, 12)
+        h = rng.randint(1, 12)
+        result.fill(Rect(rng.randrange(width), rng.randrange(height), w, h), rng.choice(tiles))
+        covered += w * h
+    return result
+
+def make_game(rooms: int, width: int, height: int, tiles: int, scripts: int, seed: int=0) -> Game:
+    rng = random.Random(seed)
+    result = Game()
+    result.name = lambda: 'Benchmark'
+    result.description = lambda: f'{rooms} rooms of {width}x{height} cells, {tiles} tiles, {scripts} scripts, seed {seed}'
+    result.project_name = lambda: 'bench'
+    result.spawn_x_loc = lambda: 0
+    result.spawn_y_loc = lambda: 0
+    for i in range(rooms):
+        # rooms have their own tile objects, like rooms made in the editor
+        result.rooms += [make_room(f'room{i}', width, height, make_tiles(tiles, scripts, rng), rng)]
+    result.spawn_room = result.rooms[0]
+    return result
+
+def generate(dir: str, rooms: int, width: int, height: int, tiles: int, scripts: int, seed: int=0) -> None|str:
+    '''Writes a synthetic project to dir, the same arguments always give the same project.'''
+    return make_game(rooms, width, height, tiles, scripts, seed).save(dir)
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument('--height', type=int, default=64)
+    parser.add_argument('--tiles', type=int, default=16)
+    parser.add_argument('--scripts', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description='Generate a synthetic project.')
+    parser.add_argument('dir')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    err = generate(args.dir, args.rooms, args.width, args.height, args.tiles, args.scripts, args.seed)
+    if err is not None:
+        print(err)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,64 @@
+'''Compares room file size and decode time of the plain and rle layout encodings.
+
+    python -m bench.layout_encoding [size ...]
+'''
+
+import io
+import random
+import sys
+import time
+
+from game import LAYOUT_ENCODINGS, decode_room, tile_codes, write_room
+from grid import Grid, Rect
+
+TILE_COUNT = 16
+# fraction of cells covered by tiles other than the floor
+DENSITIES = [0.01, 0.1, 0.5]
+
+def make_grid(size: int, density: float, seed: int=0) -> Grid:
+    rng = random.Random(seed)
+    result = Grid(size, size, 1)
+    covered = 0
+    while covered < size * size * density:
+        w = rng.randint(1, 16)
+        h = rng.randint(1, 16)
+        result.fill(Rect(rng.randrange(size), rng.randrange(size), w, h), rng.randint(2, TILE_COUNT))
+        covered += w * h
+    return result
+
+def encode(grid: Grid, encoding: str) -> str:
+    codes = tile_codes(TILE_COUNT)
+    header = {}
+    if encoding != 'plain':
+        header['version'] = 2
+        header['code_width'] = 1
+        header['layout_encoding'] = encoding
+    header['tileset'] = {code: {'name': code} for code in codes}
+    f = io.StringIO()
+    write_room(f, header, grid, [''] + codes, encoding)
+    return f.getvalue()
+
+def best_of(f: callable, runs: int=3) -> float:
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
+
+def main(sizes: list[int]):
+    print(f'{"size":>6} {"density":>8} {"encoding":>9} {"bytes":>10} {"encode ms":>10} {"decode ms":>10}')
+    for size in sizes:
+        for density in DENSITIES:
+            grid = make_grid(size, density)
+            for encoding in LAYOUT_ENCODINGS:
+                text = encode(grid, encoding)
+                encode_t = best_of(lambda: encode(grid, encoding))
+                decode_t = best_of(lambda: decode_room(text, 'bench'))
+                assert decode_room(text, 'bench')[1].data == grid.data
+                print(f'{size:>6} {density:>8} {encoding:>9} {len(text):>10} {encode_t * 1000:>10.1f} {decode_t * 1000:>10.1f}')
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [256, 1024])
@@ -0,0 +1,175 @@
+'''Times load, save, validation and bulk edits on a synthetic project and records the results.
+
+    python -m bench.scenarios [--rooms N ...] [--project DIR] [--workers N] [--out results.json] [--compare base.json]
+
+Every scenario is run --repeats times after a fresh setup and the best time is
+kept, then once more under tracemalloc for its peak memory. With --compare the
+results are checked against an earlier results file and the run fails if any
+scenario got slower by more than --threshold.
+'''
+
+import argparse
+import json
+import os
+import os.path as path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+from bench.generate import add_arguments, generate
+from game import Game
+from grid import Rect
+
+# processes load_parallel decodes rooms with unless --workers is given
+DEFAULT_WORKERS = os.cpu_count() or 2
+
+def loaded(project: str, **kwargs) -> Game:
+    result = Game.load(project, cache=False, **kwargs)
+    result.bind_loaded()
+    return result
+
+def setup_load(project: str, work: str) -> callable:
+    return lambda: Game.load(project, cache=False)
+
+def setup_load_parallel(project: str, work: str, workers: int=DEFAULT_WORKERS) -> callable:
+    return lambda: Game.load(project, workers=workers, cache=False)
+
+def setup_load_lazy(project: str, work: str) -> callable:
+    return lambda: Game.load(project, lazy=True, cache=False)
+
+def setup_load_cached(project: str, work: str) -> callable:
+    cached = path.join(work, 'cached')
+    shutil.copytree(project, cached)
+    Game.load(cached)
+    return lambda: Game.load(cached)
+
+def setup_validate(project: str, work: str) -> callable:
+    game = loaded(project)
+    return game.validate
+
+def setup_save(project: str, work: str) -> callable:
+    game = loaded(project)
+    return lambda: game.save(path.join(work, 'saved'))
+
+def setup_save_incremental(project: str, work: str) -> callable:
+    target = path.join(work, 'saved')
+    game = loaded(project)
+    game.save(target)
+    room = game.rooms[len(game.rooms) // 2]
+    room.fill(Rect(0, 0, 4, 4), room.tileset[-1])
+    return lambda: game.save(target)
+
+def setup_bulk_edit(project: str, work: str) -> callable:
+    game = loaded(project)
+    def run():
+        for room in game.rooms:
+            a, b = room.tileset[0], room.tileset[1]
+            room.fill(Rect(0, 0, room.width() // 2, room.height() // 2), b)
+            room.flood_fill(room.width() - 1, room.height() - 1, a)
+            room.replace(b, a)
+    return run
+
+# name -> setup(project, work dir) returning the function that is timed
+SCENARIOS = {
+    'load': setup_load,
+    'load_parallel': setup_load_parallel,
+    'load_lazy': setup_load_lazy,
+    'load_cached': setup_load_cached,
+    'validate': setup_validate,
+    'save': setup_save,
+    'save_incremental': setup_save_incremental,
+    'bulk_edit': setup_bulk_edit,
+}
+
+def measure(project: str, setup: callable, repeats: int) -> dict:
+    '''Best time of repeats runs, then the peak memory of one more run.'''
+    seconds = None
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as work:
+            run = setup(project, work)
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    with tempfile.TemporaryDirectory() as work:
+        run = setup(project, work)
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {'seconds': seconds, 'peak_bytes': peak}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(base: dict, results: dict, threshold: float) -> bool:
+    '''Prints how results changed against base, returns whether nothing got slower than threshold allows.'''
+    print(f'\ncompared to {base.get("commit")}')
+    print(f'{"scenario":<18} {"base s":>10} {"now s":>10} {"ratio":>7}')
+    ok = True
+    for name, result in results['scenarios'].items():
+        if name not in base['scenarios']: continue
+        before = base['scenarios'][name]['seconds']
+        ratio = result['seconds'] / before if before > 0 else 1
+        slower = ratio > 1 + threshold
+        ok = ok and not slower
+        print(f'{name:<18} {before:>10.4f} {result["seconds"]:>10.4f} {ratio:>7.2f}' + ('  REGRESSION' if slower else ''))
+    return ok
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the creator model on a synthetic project.')
+    add_arguments(parser)
+    parser.add_argument('--project', help='existing project to use instead of generating one')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='processes the load_parallel scenario decodes rooms with')
+    parser.add_argument('--out', help='file to write the results to')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown ratio above 1 that counts as a regression')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        project = args.project
+        params = {'project': project}
+        if project is None:
+            project = path.join(tmp, 'project')
+            params = {'rooms': args.rooms, 'width': args.width, 'height': args.height, 'tiles': args.tiles, 'scripts': args.scripts, 'seed': args.seed}
+            err = generate(project, args.rooms, args.width, args.height, args.tiles, args.scripts, args.seed)
+            if err is not None:
+                print(err)
+                return 1
+        if 'load_parallel' in args.scenarios:
+            params['workers'] = args.workers
+        results = {'commit': git_commit(), 'python': platform.python_version(), 'params': params, 'scenarios': {}}
+        print(f'{"scenario":<18} {"seconds":>10} {"peak MiB":>10}')
+        for name in args.scenarios:
+            setup = SCENARIOS[name]
+            if name == 'load_parallel':
+                setup = partial(setup, workers=args.workers)
+            result = measure(project, setup, args.repeats)
+            results['scenarios'][name] = result
+            print(f'{name:<18} {result["seconds"]:>10.4f} {result["peak_bytes"] / 2 ** 20:>10.2f}')
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)
+        if base['params'] != results['params']:
+            print('warning: the results were measured with different parameters')
+        if not compare(base, results, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,71 @@
+'''Measures the editor's time to first window.
+
+    python -m bench.startup [--repeats N] [--out results.json] [--compare base.json]
+
+Starts main.py in a fresh process --repeats times with the offscreen Qt platform
+unless QT_QPA_PLATFORM is set. The editor quits right after its first paint and
+reports the time since main.py started running, the best run is kept. Results
+files have the format of bench.scenarios and are compared the same way.
+'''
+
+import argparse
+import json
+import os
+import os.path as path
+import platform
+import subprocess
+import sys
+import time
+
+from bench.scenarios import compare, git_commit
+
+MAIN = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'main.py')
+
+def run_editor() -> tuple[float, float]:
+    '''Time to first window reported by the editor and the wall time of the whole process.'''
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    env['TILED_EXIT_AFTER_START'] = '1'
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, MAIN], cwd=path.dirname(MAIN), env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if done.returncode != 0:
+        raise ValueError(f'The editor exited with status {done.returncode}:\n{done.stderr}')
+    for line in done.stdout.splitlines():
+        if line.startswith('startup '):
+            return float(line.split()[1]), wall
+    raise ValueError(f'The editor did not report its startup time:\n{done.stdout}')
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description='Measure the time to first window of the editor.')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--out', help='file to write the results to')
+    parser.add_argument('--compare', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown ratio above 1 that counts as a regression')
+    args = parser.parse_args(argv)
+
+    try:
+        runs = [run_editor() for _ in range(max(1, args.repeats))]
+    except (OSError, ValueError) as e:
+        print(f'Failed to start the editor: {e}')
+        return 1
+    first_window = min(r[0] for r in runs)
+    wall = min(r[1] for r in runs)
+    print(f'time to first window {first_window * 1000:.1f} ms, process wall time {wall * 1000:.1f} ms')
+
+    results = {'commit': git_commit(), 'python': platform.python_version(), 'params': {}, 'scenarios': {
+        'first_window': {'seconds': first_window},
+        'startup_wall': {'seconds': wall},
+    }}
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)
+        if not compare(base, results, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import mmap
+import os
+import os.path as path
+import struct
+import sys
+import tempfile
+from array import array
+
+from grid import Grid
+
+CACHE_DIR = '.tiled-cache'
+MAGIC = b'TLRC'
+CACHE_VERSION = 1
+# magic, format version, source mtime_ns, source size, source sha1, width, height, meta length
+HEADER = struct.Struct('<4sHxxqq20sIII')
+
+def file_hash(p: str) -> bytes:
+    return hashlib.sha1(open(p, 'rb').read()).digest()
+
+class RoomCache:
+    '''Binary sidecar cache of decoded rooms, kept in .tiled-cache/ of a project.
+
+    Each entry holds the header, the room tileset and encoding as JSON and the
+    layout as little endian uint16 cells. Entries are valid while the room file
+    keeps its mtime and size, or failing that its hash.'''
+
+    def __init__(self, project_dir: str) -> None:
+        self.dir: str = path.join(project_dir, CACHE_DIR)
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def entry_path(self, room_path: str) -> str:
+        return path.join(self.dir, path.splitext(path.basename(room_path))[0] + '.bin')
+
+    def get(self, room_path: str) -> tuple[dict, Grid, str]:
+        '''Same as decode_room for the room at room_path, None if there is no valid entry.'''
+        result = self.read(room_path)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def read(self, room_path: str) -> tuple[dict, Grid, str]:
+        try:
+            f = open(self.entry_path(room_path), 'rb')
+            st = os.stat(room_path)
+        except OSError:
+            return None
+        with f:
+            if os.fstat(f.fileno()).st_size < HEADER.size: return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, mtime, size, digest, width, height, meta_len = HEADER.unpack_from(mm)
+                if magic != MAGIC or version != CACHE_VERSION or size != st.st_size: return None
+                if mtime != st.st_mtime_ns and digest != file_hash(room_path): return None
+                o = HEADER.size
+                meta = json.loads(bytes(mm[o:o + meta_len]))
+                o += meta_len + meta_len % 2
+                if len(mm) != o + width * height * 2: return None
+                data = array('H')
+                with memoryview(mm) as view:
+                    data.frombytes(view[o:])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        return meta['tileset'], Grid.from_data(width, height, data), meta['encoding']
+
+    def put(self, room_path: str, tileset_j: dict, grid: Grid, encoding: str):
+        '''Stores a room decoded from room_path, failing to write the cache is not an error.'''
+        try:
+            st = os.stat(room_path)
+            digest = file_hash(room_path)
+            meta = json.dumps({'encoding': encoding, 'tileset': tileset_j}).encode()
+            data = grid.data
+            if sys.byteorder == 'big':
+                data = array('H', data)
+                data.byteswap()
+            os.makedirs(self.dir, exist_ok=True)
+            p = self.entry_path(room_path)
+            fd, tmp = tempfile.mkstemp(prefix=path.basename(p) + '.', suffix='.tmp', dir=self.dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(HEADER.pack(MAGIC, CACHE_VERSION, st.st_mtime_ns, st.st_size, digest, grid.width, grid.height, len(meta)))
+                    f.write(meta)
+                    f.write(b'\0' * (len(meta) % 2))
+                    f.write(data.tobytes())
+                os.replace(tmp, p)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        except OSError:
+            pass
+
+    def stats(self) -> str:
+        return f'{self.hits} hits, {self.misses} misses'
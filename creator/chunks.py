@@ -0,0 +1,325 @@
+import json
+import os
+import os.path as path
+import sys
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+
+from grid import Grid, Rect, UNSET, find_all
+
+CHUNK_SIZE = 64
+# default limit for the memory taken by loaded chunks
+CHUNK_BUDGET = 64 * 1024 * 1024
+
+# file in the chunk directory with the number of cells holding each value in every stored chunk
+COUNTS_FILE = 'counts.json'
+
+def chunk_file(key: tuple[int, int]) -> str:
+    return f'{key[0]}_{key[1]}.bin'
+
+def encode_counts(counts: dict[tuple[int, int], dict[int, int]]) -> str:
+    return json.dumps({f'{cx}_{cy}': {str(value): n for value, n in c.items()} for (cx, cy), c in counts.items()})
+
+def decode_counts(text: str) -> dict[tuple[int, int], dict[int, int]]:
+    result = {}
+    for name, c in json.loads(text).items():
+        cx, _, cy = name.partition('_')
+        result[(int(cx), int(cy))] = {int(value): n for value, n in c.items()}
+    return result
+
+def encode_chunk(data: array) -> bytes:
+    '''Chunk files hold the zlib compressed little endian uint16 codes of the chunk, row by row.'''
+    if sys.byteorder == 'big':
+        data = array('H', data)
+        data.byteswap()
+    return zlib.compress(data.tobytes())
+
+def decode_chunk(raw: bytes) -> array:
+    result = array('H')
+    result.frombytes(zlib.decompress(raw))
+    if sys.byteorder == 'big':
+        result.byteswap()
+    return result
+
+class ChunkedGrid:
+    '''Grid split into chunk_size x chunk_size chunks that are paged in from dir on first access.
+
+    Least recently used chunks are dropped once the loaded chunks take more than budget bytes.
+    Edited chunks are pinned in memory until a save has written them, chunks taken by a
+    save stay pinned until it finished, successful or not. Chunks that are
+    neither loaded nor stored in dir have every cell unset.'''
+
+    def __init__(self, width: int, height: int, chunk_size: int=CHUNK_SIZE, dir: str=None, budget: int=CHUNK_BUDGET) -> None:
+        self.width: int = width
+        self.height: int = height
+        self.chunk_size: int = chunk_size
+        self.budget: int = budget
+        self.chunks: OrderedDict[tuple[int, int], Grid] = OrderedDict()
+        self.dirty: set[tuple[int, int]] = set()
+        # chunks taken by a save that is still being written
+        self.in_flight: set[tuple[int, int]] = set()
+        self.loaded_bytes: int = 0
+        # directory chunks are read from and the keys of the chunks stored there
+        self.dir: str = None
+        self.stored: set[tuple[int, int]] = set()
+        # value counts of the stored chunks, read from the counts file of dir on first use
+        self.stored_counts: dict[tuple[int, int], dict[int, int]] = None
+        if dir is not None:
+            self.set_dir(dir)
+
+    def set_dir(self, dir: str):
+        self.dir = dir
+        self.stored = set()
+        self.stored_counts = None
+        if not path.isdir(dir): return
+        for name in os.listdir(dir):
+            if not name.endswith('.bin'): continue
+            cx, _, cy = name[:-len('.bin')].partition('_')
+            self.stored.add((int(cx), int(cy)))
+
+    def keys(self) -> list[tuple[int, int]]:
+        cs = self.chunk_size
+        return [(cx, cy) for cy in range((self.height + cs - 1) // cs) for cx in range((self.width + cs - 1) // cs)]
+
+    def chunk_rect(self, key: tuple[int, int]) -> Rect:
+        cs = self.chunk_size
+        x = key[0] * cs
+        y = key[1] * cs
+        return Rect(x, y, min(cs, self.width - x), min(cs, self.height - y))
+
+    def chunk(self, key: tuple[int, int]) -> Grid:
+        result = self.chunks.get(key)
+        if result is not None:
+            self.chunks.move_to_end(key)
+            return result
+        rect = self.chunk_rect(key)
+        if key in self.stored:
+            raw = open(path.join(self.dir, chunk_file(key)), 'rb').read()
+            result = Grid.from_data(rect.width, rect.height, decode_chunk(raw))
+        else:
+            result = Grid(rect.width, rect.height)
+        self.chunks[key] = result
+        self.loaded_bytes += result.nbytes()
+        self.evict()
+        return result
+
+    def evict(self):
+        if self.loaded_bytes <= self.budget: return
+        for key in list(self.chunks):
+            if self.loaded_bytes <= self.budget: break
+            if key in self.dirty or key in self.in_flight: continue
+            self.loaded_bytes -= self.chunks.pop(key).nbytes()
+
+    def chunks_in(self, rect: Rect) -> list[tuple[tuple[int, int], Rect]]:
+        '''Chunks overlapping rect along with the overlapping part in chunk coordinates.'''
+        rect = self.clip(rect)
+        if rect is None: return []
+        cs = self.chunk_size
+        result = []
+        for cy in range(rect.y // cs, (rect.y + rect.height - 1) // cs + 1):
+            for cx in range(rect.x // cs, (rect.x + rect.width - 1) // cs + 1):
+                x1 = max(rect.x, cx * cs)
+                y1 = max(rect.y, cy * cs)
+                x2 = min(rect.x + rect.width, (cx + 1) * cs)
+                y2 = min(rect.y + rect.height, (cy + 1) * cs)
+                result += [((cx, cy), Rect(x1 - cx * cs, y1 - cy * cs, x2 - x1, y2 - y1))]
+        return result
+
+    clip = Grid.clip
+
+    def get(self, x: int, y: int) -> int:
+        cs = self.chunk_size
+        return self.chunk((x // cs, y // cs)).get(x % cs, y % cs)
+
+    def set(self, x: int, y: int, value: int) -> int:
+        cs = self.chunk_size
+        key = (x // cs, y // cs)
+        self.dirty.add(key)
+        return self.chunk(key).set(x % cs, y % cs, value)
+
+    def row(self, y: int, x1: int=0, x2: int=None) -> array:
+        if x2 is None: x2 = self.width
+        result = array('H')
+        for key, rect in self.chunks_in(Rect(x1, y, x2 - x1, 1)):
+            result += self.chunk(key).row(rect.y, rect.x, rect.x + rect.width)
+        return result
+
+    def find(self, value: int) -> int:
+        for key in self.keys():
+            rect = self.chunk_rect(key)
+            i = self.chunk(key).find(value)
+            if i != -1:
+                return (rect.y + i // rect.width) * self.width + rect.x + i % rect.width
+        return -1
+
+    def find_unset(self) -> int:
+        '''Like find(UNSET) but without paging in stored chunks, saved chunks never hold unset cells.'''
+        for key in self.keys():
+            if key in self.stored and key not in self.chunks: continue
+            rect = self.chunk_rect(key)
+            if key not in self.chunks:
+                return rect.y * self.width + rect.x
+            i = self.chunks[key].find(UNSET)
+            if i != -1:
+                return (rect.y + i // rect.width) * self.width + rect.x + i % rect.width
+        return -1
+
+    def count(self, value: int) -> int:
+        return sum(self.chunk(key).count(value) for key in self.keys())
+
+    def read_counts(self) -> dict[tuple[int, int], dict[int, int]]:
+        '''Value counts of the stored chunks, chunks saved before counts were written have none.'''
+        if self.stored_counts is None:
+            self.stored_counts = {}
+            p = None if self.dir is None else path.join(self.dir, COUNTS_FILE)
+            if p is not None and path.exists(p):
+                self.stored_counts = decode_counts(open(p, 'r', encoding='utf-8').read())
+        return self.stored_counts
+
+    def counts_with(self, taken: dict[tuple[int, int], array]) -> dict[tuple[int, int], dict[int, int]]:
+        '''Value counts of the stored chunks once the chunks taken by a save are written.'''
+        result = {key: c for key, c in self.read_counts().items() if key in self.stored}
+        for key, data in taken.items():
+            result[key] = dict(Counter(data))
+        return result
+
+    # parts of a ChunkedGrid are its chunks
+    def part_counts(self):
+        '''Chunks along with the number of cells holding each value in them.
+
+        Stored chunks that aren't loaded are counted from the counts file, so opening a
+        room doesn't read its chunks. Chunks without counts are read without paging them in.'''
+        stored_counts = self.read_counts()
+        for key in self.keys():
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                yield key, Counter(chunk.data)
+            elif key in stored_counts:
+                yield key, stored_counts[key]
+            elif key in self.stored:
+                yield key, Counter(decode_chunk(open(path.join(self.dir, chunk_file(key)), 'rb').read()))
+            else:
+                rect = self.chunk_rect(key)
+                yield key, {UNSET: rect.width * rect.height}
+
+    def part_of(self, i: int) -> tuple[int, int]:
+        cs = self.chunk_size
+        y, x = divmod(i, self.width)
+        return (x // cs, y // cs)
+
+    def parts_in(self, rect: Rect) -> 'set[tuple[int, int]]':
+        return {key for key, _ in self.chunks_in(rect)}
+
+    def part_cells(self, key: tuple[int, int], value: int) -> list[int]:
+        rect = self.chunk_rect(key)
+        return [(rect.y + i // rect.width) * self.width + rect.x + i % rect.width for i in find_all(self.chunk(key).data, value)]
+
+    def set_cells(self, indices: array, values: array):
+        cs = self.chunk_size
+        key = None
+        for i, value in zip(indices, values):
+            y, x = divmod(i, self.width)
+            if (x // cs, y // cs) != key:
+                key = (x // cs, y // cs)
+                self.dirty.add(key)
+                chunk = self.chunk(key)
+            chunk.data[y % cs * chunk.width + x % cs] = value
+
+    def nbytes(self) -> int:
+        return self.loaded_bytes
+
+    def fill(self, rect: Rect, value: int) -> Rect:
+        for key, local in self.chunks_in(rect):
+            # marked dirty first so loading the chunk can't evict it
+            self.dirty.add(key)
+            self.chunk(key).fill(local, value)
+        return self.clip(rect)
+
+    def region(self, rect: Rect) -> Grid:
+        rect = self.clip(rect)
+        if rect is None: return Grid()
+        result = Grid(rect.width, rect.height)
+        for key, local in self.chunks_in(rect):
+            origin = self.chunk_rect(key)
+            result.blit(origin.x + local.x - rect.x, origin.y + local.y - rect.y, self.chunk(key).region(local))
+        return result
+
+    def blit(self, x: int, y: int, other: Grid) -> Rect:
+        for key, local in self.chunks_in(Rect(x, y, other.width, other.height)):
+            origin = self.chunk_rect(key)
+            part = other.region(Rect(origin.x + local.x - x, origin.y + local.y - y, local.width, local.height))
+            self.dirty.add(key)
+            self.chunk(key).blit(local.x, local.y, part)
+        return self.clip(Rect(x, y, other.width, other.height))
+
+    def replace(self, old: int, new: int, changed: array=None) -> Rect:
+        result = None
+        for key in self.keys():
+            cells = None if changed is None else array('I')
+            local = self.chunk(key).replace(old, new, cells)
+            if local is None: continue
+            self.dirty.add(key)
+            origin = self.chunk_rect(key)
+            if changed is not None:
+                changed.extend((origin.y + i // origin.width) * self.width + origin.x + i % origin.width for i in cells)
+            result = Rect(origin.x + local.x, origin.y + local.y, local.width, local.height).union(result)
+        return result
+
+    def flood_fill(self, x: int, y: int, value: int, changed: array=None) -> Rect:
+        '''Scanline fill of the 4-connected area of equal cells around (x, y).'''
+        target = self.get(x, y)
+        if target == value: return None
+        result = None
+        stack = [(x, y)]
+        while stack:
+            x, y = stack.pop()
+            if self.get(x, y) != target: continue
+            l = x
+            while l > 0 and self.get(l - 1, y) == target:
+                l -= 1
+            r = x
+            while r < self.width - 1 and self.get(r + 1, y) == target:
+                r += 1
+            line = Rect(l, y, r - l + 1, 1)
+            self.fill(line, value)
+            if changed is not None: changed.extend(range(y * self.width + l, y * self.width + r + 1))
+            result = line.union(result)
+            for ny in (y - 1, y + 1):
+                if ny < 0 or ny >= self.height: continue
+                inside = False
+                for nx, v in enumerate(self.row(ny, l, r + 1), l):
+                    if v == target:
+                        if not inside:
+                            stack += [(nx, ny)]
+                            inside = True
+                    else:
+                        inside = False
+        return result
+
+    def take_dirty(self) -> dict[tuple[int, int], array]:
+        '''Copies of the edited chunks, which are considered clean from now on.
+
+        The chunks stay pinned until saved or save_failed is called with the taken keys.'''
+        result = {}
+        for key in self.dirty:
+            result[key] = array('H', self.chunks[key].data)
+        self.in_flight |= self.dirty
+        self.dirty = set()
+        return result
+
+    def saved(self, dir: str, keys: 'set[tuple[int, int]]', taken: 'set[tuple[int, int]]', counts: dict=None):
+        '''The save that took the chunks in taken wrote them, dir now stores the chunks in keys with counts.'''
+        if dir != self.dir:
+            self.dir = dir
+            self.stored = set()
+        self.stored |= keys
+        if counts is not None:
+            self.stored_counts = counts
+        self.in_flight -= taken
+        self.evict()
+
+    def save_failed(self, taken: 'set[tuple[int, int]]'):
+        '''The chunks in taken weren't written, they are edited again.'''
+        self.dirty |= taken
+        self.in_flight -= taken
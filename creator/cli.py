@@ -0,0 +1,98 @@
+'''Validates and re-saves projects without the editor.
+
+    python cli.py validate PROJECT ...
+    python cli.py resave PROJECT ... [--encoding rle] [--out DIR]
+    python cli.py validate PROJECT ... --profile trace.json
+
+Projects are processed in parallel, one per worker process, and the time
+taken by every phase is reported per project. With --profile the spans recorded
+by every worker are written to a Chrome trace and summarized after the results.
+'''
+
+import argparse
+import os
+import os.path as path
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from game import Game, LAYOUT_ENCODINGS
+from profiling import PROFILER
+
+PHASES = ['load', 'validate', 'save']
+
+def process(project: str, command: str, encoding: str=None, out: str=None, cache: bool=False, profile: bool=False) -> tuple[str, None|str, dict[str, float], list]:
+    '''Runs command on the project at project, returns it with the error message, the seconds taken per phase and the recorded spans.'''
+    PROFILER.enabled = profile
+    project, err, timings = run(project, command, encoding, out, cache)
+    return project, err, timings, PROFILER.take()
+
+def run(project: str, command: str, encoding: str, out: str, cache: bool) -> tuple[str, None|str, dict[str, float]]:
+    timings = {}
+    start = time.perf_counter()
+    try:
+        game = Game.load(project, cache=cache)
+    except (OSError, ValueError, KeyError) as e:
+        return project, f'Failed to load: {e}', timings
+    game.bind_loaded()
+    if encoding is not None:
+        game.layout_encoding = lambda: encoding
+    timings['load'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    err = game.validate()
+    timings['validate'] = time.perf_counter() - start
+    if err is not None or command == 'validate':
+        return project, err, timings
+
+    start = time.perf_counter()
+    target = project if out is None else path.join(out, path.basename(path.normpath(project)))
+    for room in game.rooms:
+        # rewrite every room so all of them end up in the current format
+        room.dirty = True
+    err = game.save(target)
+    timings['save'] = time.perf_counter() - start
+    return project, err, timings
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description='Validate and re-save tiled-engine projects.')
+    parser.add_argument('command', choices=['validate', 'resave'])
+    parser.add_argument('projects', nargs='+', help='project directories, the ones holding manifest.json')
+    parser.add_argument('--encoding', choices=LAYOUT_ENCODINGS, help='layout encoding to re-save rooms with')
+    parser.add_argument('--out', help='directory to save the projects to instead of in place')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--cache', action='store_true', help='read and update the binary room cache of the projects')
+    parser.add_argument('--profile', metavar='TRACE', help='record spans and write them to TRACE as a Chrome trace')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    failed = 0
+    totals = dict.fromkeys(PHASES, 0.0)
+    width = max(len(p) for p in args.projects)
+    print(f'{"project":<{width}}' + ''.join(f'{phase:>10}' for phase in PHASES))
+    with ProcessPoolExecutor(max(1, args.jobs)) as pool:
+        n = len(args.projects)
+        profile = args.profile is not None
+        results = pool.map(process, args.projects, [args.command] * n, [args.encoding] * n, [args.out] * n, [args.cache] * n, [profile] * n)
+        for project, err, timings, spans in results:
+            PROFILER.events += spans
+            columns = ''
+            for phase in PHASES:
+                if phase in timings:
+                    totals[phase] += timings[phase]
+                    columns += f'{timings[phase]:>10.3f}'
+                else:
+                    columns += f'{"-":>10}'
+            print(f'{project:<{width}}{columns}  {"ok" if err is None else err}')
+            if err is not None:
+                failed += 1
+    print(f'{"total":<{width}}' + ''.join(f'{totals[phase]:>10.3f}' for phase in PHASES))
+    print(f'{len(args.projects)} projects, {failed} failed, {time.perf_counter() - start:.3f}s wall time')
+    if args.profile is not None:
+        PROFILER.write_trace(args.profile)
+        print()
+        print(PROFILER.summary())
+    return 1 if failed > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,86 +1,858 @@
+import hashlib
 import json
 import os
 import os.path as path
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from array import array
+from itertools import groupby
+
+from cache import RoomCache
+from chunks import COUNTS_FILE, ChunkedGrid, chunk_file, encode_chunk, encode_counts
+from grid import CellIndex, Diff, Grid, Rect, UNSET
+from profiling import PROFILER
 
 CHARS = [chr(i) for i in range(ord('a'), ord('z')+1)] + [chr(i) for i in range(ord('A'), ord('Z')+1)] + [chr(i) for i in range(ord('0'), ord('9')+1)]
+# version 1 rooms use one char per cell, version 2 rooms use code_width chars per cell
+# and may have their layout stored in a layout_encoding other than plain
+ROOM_VERSION = 2
+# plain stores every cell code, rle stores each row as comma separated code*count runs
+LAYOUT_ENCODINGS = ['plain', 'rle']
+# rooms with more cells keep their layout in a ChunkedGrid, those are always stored
+# with the chunks encoding: a directory of binary chunk files next to the room file
+CHUNKED_ROOM_CELLS = 512 * 512
+# codes are stored as uint16 in the grid and 0 is reserved for unset cells
+MAX_TILES = 65535
+# project-wide tileset next to the manifest, room tilesets refer to its tiles as {"shared": index},
+# its script paths are relative to the rooms directory like the ones in room files
+SHARED_TILESET = 'tileset.json'
+# tile flags packed into TileDef.flags
+PASSABLE = 1
+SEETHROUGH = 2
 
-def script_path(tile):
-    return path.join('scripts', f'{tile.name}_script.lua')
+def tile_codes(count: int) -> list[str]:
+    '''Fixed width codes for count tiles, single chars whenever count fits in CHARS.'''
+    width = 1
+    while len(CHARS) ** width < count:
+        width += 1
+    result = []
+    for i in range(count):
+        code = ''
+        for _ in range(width):
+            code = CHARS[i % len(CHARS)] + code
+            i //= len(CHARS)
+        result += [code]
+    return result
 
-class Tile:
-    def __init__(self) -> None:
-        self.name: str = ''
-        self.display_name: str = ''
-        self.seethrough: bool = False
-        self.passable: bool = False
+def script_path(script: str) -> str:
+    '''Scripts are stored under the hash of their text, tiles with equal scripts share one file.'''
+    return path.join('scripts', hashlib.sha1(script.encode()).hexdigest() + '.lua')
+
+def read_text(p: str) -> str:
+    return open(p, 'r', encoding='utf-8').read()
+
+def decode_rle_row(row: str, lookup: dict[str, int], data: array) -> int:
+    '''Appends the cells of an rle row to data, returns the number of cells appended.'''
+    count = 0
+    for run in row.split(','):
+        code, _, n = run.partition('*')
+        n = int(n) if n else 1
+        data.extend(array('H', [lookup[code]]) * n)
+        count += n
+    return count
+
+def encode_rle_row(row: array, codes: list[str]) -> str:
+    runs = []
+    for code, run in groupby(row):
+        n = sum(1 for _ in run)
+        runs += [codes[code] if n == 1 else f'{codes[code]}*{n}']
+    return ','.join(runs)
+
+def decode_room(text: str, room_path: str) -> tuple[dict, Grid, str]:
+    '''Parses a room file into its tileset JSON, a grid of codes and the layout encoding it used.
+
+    The n-th tileset entry is stored as code n, matching the order Room.build adds tiles in.
+    Only depends on its arguments so it can run in a worker process.'''
+    room_data = json.loads(text)
+    version = room_data.get('version', 1)
+    if version == 1:
+        code_width = 1
+    elif version == 2:
+        code_width = room_data['code_width']
+    else:
+        raise ValueError(f'Room {room_path} has unsupported version {version}')
+    encoding = room_data.get('layout_encoding', 'plain')
+    if encoding not in LAYOUT_ENCODINGS and encoding != 'chunks':
+        raise ValueError(f'Room {room_path} has unsupported layout encoding {encoding}')
+    tileset_j = room_data['tileset']
+    if encoding == 'chunks':
+        chunks_dir = path.join(path.dirname(room_path), room_data['chunks'])
+        return tileset_j, ChunkedGrid(room_data['width'], room_data['height'], room_data['chunk_size'], chunks_dir), encoding
+    lookup = {}
+    for i, tile_c in enumerate(tileset_j):
+        lookup[tile_c] = i + 1
+    rows = [row for row in room_data['layout'].split('\n') if row != '']
+    if encoding == 'rle':
+        data = array('H')
+        width = 0
+        for row in rows:
+            count = decode_rle_row(row, lookup, data)
+            if width == 0:
+                width = count
+            elif count != width:
+                raise ValueError(f'Room {room_path} has rows of different length')
+        return tileset_j, Grid.from_data(width, len(rows), data), encoding
+    width = len(rows[0]) if rows else 0
+    if width % code_width != 0:
+        raise ValueError(f'Room {room_path} has rows that are not a whole number of codes')
+    data = array('H')
+    for row in rows:
+        if len(row) != width:
+            raise ValueError(f'Room {room_path} has rows of different length')
+        if code_width == 1:
+            data.extend(map(lookup.__getitem__, row))
+        else:
+            data.extend(lookup[row[i:i + code_width]] for i in range(0, width, code_width))
+    return tileset_j, Grid.from_data(width // code_width, len(rows), data), encoding
+
+def decode_room_file(room_path: str) -> tuple[dict, Grid, str]:
+    '''decode_room of the file at room_path, read by the worker so its text isn't sent to it.'''
+    return decode_room(read_text(room_path), room_path)
+
+# process pool rooms are decoded on, kept between loads since starting the processes
+# can take longer than decoding a small project
+_decode_pool: ProcessPoolExecutor = None
+_decode_workers: int = 0
+
+def decode_pool(workers: int) -> ProcessPoolExecutor:
+    global _decode_pool, _decode_workers
+    if _decode_pool is None or _decode_workers != workers:
+        if _decode_pool is not None:
+            _decode_pool.shutdown()
+        _decode_pool = ProcessPoolExecutor(workers)
+        _decode_workers = workers
+    return _decode_pool
+
+def load_rooms_parallel(rooms: list[tuple['Room', str]], workers: int, cache: RoomCache=None):
+    '''Reads files on a thread pool and decodes rooms on a process pool, then builds the rooms in order.
+
+    Rooms with a valid entry in cache skip decoding, the others are added to it. Decoding
+    is CPU bound, so it only uses processes with more than one core to put them on,
+    otherwise rooms are decoded here while the threads read the next files.'''
+    paths = [p for _, p in rooms]
+    processes = min(workers, os.cpu_count() or 1)
+    with ThreadPoolExecutor(workers) as io:
+        decoded = [None] * len(paths)
+        if cache is not None:
+            decoded = list(io.map(cache.get, paths))
+        stale = [i for i, d in enumerate(decoded) if d is None]
+        stale_paths = [paths[i] for i in stale]
+        with PROFILER.span('decode rooms', rooms=len(stale), processes=processes):
+            if processes > 1:
+                results = decode_pool(processes).map(decode_room_file, stale_paths, chunksize=max(1, len(stale) // (processes * 4)))
+            else:
+                results = map(decode_room, io.map(read_text, stale_paths), stale_paths)
+            for i, d in zip(stale, results):
+                decoded[i] = d
+                if cache is not None and d[2] != 'chunks':
+                    cache.put(paths[i], *d)
+        script_paths = set()
+        for p, (tileset_j, _, _) in zip(paths, decoded):
+            for tile_j in tileset_j.values():
+                if 'events' in tile_j:
+                    script_paths.add(path.join(path.dirname(p), tile_j['events']['script']))
+        script_paths = list(script_paths)
+        with PROFILER.span('read scripts', scripts=len(script_paths)):
+            scripts = dict(zip(script_paths, io.map(read_text, script_paths)))
+    with PROFILER.span('build rooms'):
+        for (room, p), (tileset_j, grid, encoding) in zip(rooms, decoded):
+            room.build(tileset_j, grid, encoding, p, scripts)
+
+class TileDef:
+    '''Immutable tile definition, equal definitions are stored once per project by TileDefs.
+
+    Rooms refer to definitions through Tile handles, so they are cheap to compare and
+    hash and can be used as dict keys. The script path and JSON are computed once.'''
+
+    __slots__ = ('name', 'display_name', 'flags', 'script', 'step_func', 'interact_func', 'image_path', '_hash', '_script_path', '_json')
 
-        self.script: str = ''
-        self.step_func: str = ''
-        self.interact_func: str = ''
+    def __init__(self, name: str='', display_name: str='', flags: int=0, script: str='', step_func: str='', interact_func: str='', image_path: str=None) -> None:
+        init = object.__setattr__
+        init(self, 'name', name)
+        init(self, 'display_name', display_name)
+        init(self, 'flags', flags)
+        init(self, 'script', script)
+        init(self, 'step_func', step_func)
+        init(self, 'interact_func', interact_func)
+        init(self, 'image_path', image_path)
+        init(self, '_hash', hash(self.key()))
+        init(self, '_script_path', None)
+        init(self, '_json', None)
 
-        self.image = None
-        self.image_path: str = None
+    def __setattr__(self, name: str, value):
+        raise AttributeError(f'TileDef is immutable, use replace to change {name}')
+
+    def key(self) -> tuple:
+        return (self.name, self.display_name, self.flags, self.script, self.step_func, self.interact_func, self.image_path)
+
+    def __eq__(self, other) -> bool:
+        if self is other: return True
+        if not isinstance(other, TileDef) or self._hash != other._hash: return False
+        return self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def replace(self, **fields) -> 'TileDef':
+        return TileDef(**{'name': self.name, 'display_name': self.display_name, 'flags': self.flags, 'script': self.script,
+            'step_func': self.step_func, 'interact_func': self.interact_func, 'image_path': self.image_path, **fields})
+
+    def with_flag(self, flag: int, value: bool) -> 'TileDef':
+        return self.replace(flags=self.flags | flag if value else self.flags & ~flag)
+
+    def script_path(self) -> str:
+        if self._script_path is None:
+            object.__setattr__(self, '_script_path', script_path(self.script))
+        return self._script_path
 
     def to_json(self) -> dict:
+        '''The room JSON entry of the definition, shared by all calls so it must not be modified.'''
+        if self._json is not None:
+            return self._json
         result = {}
         result['name'] = self.name
         result['display_name'] = self.display_name
-        result['passable'] = self.passable
-        result['seethrough'] = self.seethrough
+        result['passable'] = bool(self.flags & PASSABLE)
+        result['seethrough'] = bool(self.flags & SEETHROUGH)
         if self.script != '':
             events = {}
-            events['script'] = script_path(self)
+            events['script'] = self.script_path()
             if self.step_func != '':
                 events['step'] = self.step_func
             if self.interact_func != '':
                 events['interact'] = self.interact_func
             result['events'] = events
+        object.__setattr__(self, '_json', result)
         return result
 
+EMPTY_TILE_DEF = TileDef()
+
+class TileDefs:
+    '''Interns the tile definitions of a project and the scripts they read, so equal ones are stored once.'''
+
+    def __init__(self) -> None:
+        self.defs: dict[TileDef, TileDef] = {}
+        # script path -> text, files are named by the hash of their text so they don't change while loading
+        self.scripts: dict[str, str] = {}
+
+    def intern(self, defn: TileDef) -> TileDef:
+        return self.defs.setdefault(defn, defn)
+
+    def read_script(self, p: str) -> str:
+        result = self.scripts.get(p)
+        if result is None:
+            with PROFILER.span('read script', path=p):
+                result = read_text(p)
+            self.scripts[p] = result
+        return result
+
+class Tile:
+    '''Tile of a room tileset, the handle rooms, the history and the editor hold on to.
+
+    Tiles compare and hash by identity, their fields live in an immutable TileDef that
+    is replaced whenever one of them is changed.'''
+
+    __slots__ = ('defn',)
+
+    def __init__(self, defn: TileDef=EMPTY_TILE_DEF) -> None:
+        self.defn: TileDef = defn
+
+    @property
+    def name(self) -> str:
+        return self.defn.name
+
+    @name.setter
+    def name(self, value: str):
+        self.defn = self.defn.replace(name=value)
+
+    @property
+    def display_name(self) -> str:
+        return self.defn.display_name
+
+    @display_name.setter
+    def display_name(self, value: str):
+        self.defn = self.defn.replace(display_name=value)
+
+    @property
+    def passable(self) -> bool:
+        return bool(self.defn.flags & PASSABLE)
+
+    @passable.setter
+    def passable(self, value: bool):
+        self.defn = self.defn.with_flag(PASSABLE, value)
+
+    @property
+    def seethrough(self) -> bool:
+        return bool(self.defn.flags & SEETHROUGH)
+
+    @seethrough.setter
+    def seethrough(self, value: bool):
+        self.defn = self.defn.with_flag(SEETHROUGH, value)
+
+    @property
+    def script(self) -> str:
+        return self.defn.script
+
+    @script.setter
+    def script(self, value: str):
+        self.defn = self.defn.replace(script=value)
+
+    @property
+    def step_func(self) -> str:
+        return self.defn.step_func
+
+    @step_func.setter
+    def step_func(self, value: str):
+        self.defn = self.defn.replace(step_func=value)
+
+    @property
+    def interact_func(self) -> str:
+        return self.defn.interact_func
+
+    @interact_func.setter
+    def interact_func(self, value: str):
+        self.defn = self.defn.replace(interact_func=value)
+
+    @property
+    def image_path(self) -> str:
+        return self.defn.image_path
+
+    @image_path.setter
+    def image_path(self, value: str):
+        self.defn = self.defn.replace(image_path=value)
+
+    def to_json(self) -> dict:
+        return self.defn.to_json()
+
+    def load(tile_j: dict, room_dir: str, scripts: dict[str, str]=None, defs: TileDefs=None) -> 'Tile':
+        '''Creates a tile from its room JSON entry.
+
+        Scripts are taken from scripts or defs when found there and read from disk otherwise,
+        the definition is interned in defs when given.'''
+        flags = (PASSABLE if tile_j['passable'] else 0) | (SEETHROUGH if tile_j['seethrough'] else 0)
+        script = ''
+        step_func = ''
+        interact_func = ''
+        if 'events' in tile_j:
+            events = tile_j['events']
+            sp = path.join(room_dir, events['script'])
+            if scripts is not None and sp in scripts:
+                script = scripts[sp]
+            elif defs is not None:
+                script = defs.read_script(sp)
+            else:
+                with PROFILER.span('read script', path=sp):
+                    script = read_text(sp)
+            interact_func = events.get('interact', '')
+            step_func = events.get('step', '')
+        defn = TileDef(tile_j['name'], tile_j['display_name'], flags, script, step_func, interact_func, tile_j.get('image_path', 'error.png'))
+        if defs is not None:
+            defn = defs.intern(defn)
+        return Tile(defn)
+
+    def clone(self) -> 'Tile':
+        return Tile(self.defn)
+
     def copy(self, other: 'Tile'):
-        self.__dict__ = other.__dict__
+        self.defn = other.defn
 
 class Room:
-    def __init__(self) -> None:
+    def __init__(self, width: int=0, height: int=0) -> None:
         self.name: lambda: str = None
-        self.tileset: list[Tile] = []
-        self.layout: list[list[Tile]] = []
+        # room file that is read the first time the room contents are accessed
+        self.source: str = None
+        # room file the current contents were loaded from or last saved to
+        self.origin: str = None
+        # layout encoding of the origin file
+        self.encoding: str = 'plain'
+        # decoded rooms are read from and added to it when set
+        self.cache: RoomCache = None
+        # project-wide tiles the room file refers to by index
+        self.shared_tiles: list[Tile] = []
+        # tile definitions of the project, tiles added to the room are interned in it when set
+        self.defs: TileDefs = None
+        self.dirty: bool = True
+        self._tileset: list[Tile] = []
+        # chosen before allocating, a Grid of a huge room would not fit in memory
+        self._grid: Grid|ChunkedGrid = ChunkedGrid(width, height) if width * height > CHUNKED_ROOM_CELLS else Grid(width, height)
+        # tile -> value stored in the grid, tileset[i] is stored as i + 1
+        self._codes: dict[Tile, int] = {}
+        # called with the room, the changed area and the changed cells after every layout change
+        self.listeners: list[callable] = []
+        # tile usage, built on first use and then updated by every change
+        self._index: CellIndex = None
 
-    def save(self, dir: str):
-        p = path.join(dir, f'{self.name()}.json')
-        j = {}
-        tilesets_j = {}
-        d = {}
-        i = 0
-        for tile in self.tileset:
-            cc = CHARS[i]
-            d[tile] = cc
-            tilesets_j[cc] = tile.to_json()
-            i += 1
-            open(path.join(dir, script_path(tile)), 'w').write(tile.script)
-
-        j['tileset'] = tilesets_j
-
-        layout_j = ''
-        height = len(self.layout)
-        width = len(self.layout[0])
-        for i in range(height):
-            for ii in range(width):
-                layout_j += d[self.layout[ii][i]]
-            layout_j += '\n'
-
-        j['layout'] = layout_j
-
-        open(p, 'w').write(json.dumps(j, indent=4))
+    @property
+    def tileset(self) -> list[Tile]:
+        self.ensure_loaded()
+        return self._tileset
+
+    @property
+    def grid(self) -> Grid:
+        self.ensure_loaded()
+        return self._grid
+
+    @grid.setter
+    def grid(self, value: Grid):
+        self.ensure_loaded()
+        self._grid = value
+        self._index = None
+
+    @property
+    def codes(self) -> dict[Tile, int]:
+        self.ensure_loaded()
+        return self._codes
+
+    @property
+    def index(self) -> CellIndex:
+        if self._index is None:
+            self._index = CellIndex(self.grid)
+        return self._index
+
+    def is_loaded(self) -> bool:
+        return self.source is None
+
+    def ensure_loaded(self):
+        if self.source is None: return
+        source = self.source
+        self.source = None
+        self.read(source)
+
+    def read(self, room_path: str):
+        with PROFILER.span('read room', path=room_path):
+            decoded = None
+            if self.cache is not None:
+                with PROFILER.span('room cache get'):
+                    decoded = self.cache.get(room_path)
+            if decoded is None:
+                with PROFILER.span('read room file'):
+                    text = open(room_path, 'r', encoding='utf-8').read()
+                with PROFILER.span('decode room'):
+                    decoded = decode_room(text, room_path)
+                if self.cache is not None and decoded[2] != 'chunks':
+                    with PROFILER.span('room cache put'):
+                        self.cache.put(room_path, *decoded)
+            with PROFILER.span('build room'):
+                self.build(*decoded, room_path)
+
+    def build(self, tileset_j: dict, grid: Grid, encoding: str, room_path: str, scripts: dict[str, str]=None):
+        '''Fills the room with a tileset and layout decoded by decode_room.'''
+        room_dir = path.dirname(room_path)
+        for tile_j in tileset_j.values():
+            if 'shared' in tile_j:
+                self.add_tile(self.shared_tiles[tile_j['shared']])
+            else:
+                self.add_tile(Tile.load(tile_j, room_dir, scripts, self.defs))
+        self._grid = grid
+        self._index = None
+        self.origin = path.abspath(room_path)
+        self.encoding = encoding
+        self.dirty = False
+
+    def width(self) -> int:
+        return self.grid.width
+
+    def height(self) -> int:
+        return self.grid.height
+
+    def add_tile(self, tile: Tile) -> int:
+        if self.defs is not None:
+            tile.defn = self.defs.intern(tile.defn)
+        self.tileset.append(tile)
+        code = len(self.tileset)
+        self.codes[tile] = code
+        self.dirty = True
+        return code
+
+    def pop_error(self, codes: list[int]) -> str:
+        '''Why the tiles stored as codes can't be removed, None if they are the last tiles of the tileset.'''
+        n = len(self.tileset)
+        if list(codes) != list(range(n - len(codes) + 1, n + 1)):
+            return f'Tiles {list(codes)} are not the last of the {n} tiles of the room'
         return None
 
+    def pop_tiles(self, codes: list[int]):
+        '''Removes the tiles stored as codes, which have to be the last tiles of the tileset and unused.'''
+        err = self.pop_error(codes)
+        if err is not None:
+            raise ValueError(err)
+        for code in reversed(codes):
+            self.codes.pop(self.tileset.pop())
+            if self._index is not None:
+                self._index.remove(code)
+        self.dirty = True
+
+    def replace_tile(self, i: int, tile: Tile):
+        '''Puts tile in place of tileset[i], the cells holding the old tile hold tile afterwards.'''
+        old = self.tileset[i]
+        self.tileset[i] = tile
+        self.codes[tile] = self.codes.pop(old)
+        self.dirty = True
+
+    def edit_tile(self, i: int, tile: Tile):
+        self.tileset[i].copy(tile)
+        if self.defs is not None:
+            self.tileset[i].defn = self.defs.intern(tile.defn)
+        self.dirty = True
+
+    def tile_by_code(self, code: int) -> Tile:
+        if code == UNSET: return None
+        return self.tileset[code - 1]
+
+    def tile_at(self, x: int, y: int) -> Tile:
+        return self.tile_by_code(self.grid.get(x, y))
+
+    def set_tile(self, x: int, y: int, tile: Tile) -> None:
+        code = self.code_of(tile)
+        old = self.grid.set(x, y, code)
+        if old != code:
+            diff = Diff('paint', array('I', [y * self.width() + x]), array('H', [old]), array('H', [code]))
+            self.changed(Rect(x, y, 1, 1), diff)
+
+    def code_of(self, tile: Tile) -> int:
+        if tile is None: return UNSET
+        return self.codes[tile]
+
+    def cells_of(self, tile: Tile, rect: Rect=None) -> list[tuple[int, int]]:
+        '''(x, y) of every cell holding tile, None for unset cells, only those inside rect when it is given.'''
+        return self.index.positions(self.code_of(tile), rect)
+
+    def usage(self, tile: Tile) -> int:
+        '''Number of cells holding tile, None for unset cells.'''
+        return self.index.count(self.code_of(tile))
+
+    def changed(self, rect: Rect, diff: Diff) -> Rect:
+        if rect is not None:
+            self.dirty = True
+            if self._index is not None:
+                self._index.update(diff)
+            for listener in self.listeners:
+                listener(self, rect, diff)
+        return rect
+
+    # bulk operations, each returns the changed area or None if nothing changed
+    def fill(self, rect: Rect, tile: Tile) -> Rect:
+        rect = self.grid.clip(rect)
+        if rect is None: return None
+        before = self.grid.region(rect)
+        self.grid.fill(rect, self.code_of(tile))
+        return self.changed(rect, Diff.between('paint', rect, self.width(), before, self.grid.region(rect)))
+
+    def replace(self, old: Tile, new: Tile) -> Rect:
+        old = self.code_of(old)
+        new = self.code_of(new)
+        cells = array('I')
+        rect = self.grid.replace(old, new, cells)
+        return self.changed(rect, Diff('replace', cells, array('H', [old]) * len(cells), array('H', [new]) * len(cells)))
+
+    def flood_fill(self, x: int, y: int, tile: Tile) -> Rect:
+        old = self.grid.get(x, y)
+        new = self.code_of(tile)
+        cells = array('I')
+        rect = self.grid.flood_fill(x, y, new, cells)
+        return self.changed(rect, Diff('flood_fill', cells, array('H', [old]) * len(cells), array('H', [new]) * len(cells)))
+
+    def apply(self, diff: Diff, undo: bool=False) -> Rect:
+        '''Sets the cells of diff to their values after it, or before it when undo is set.'''
+        diff = diff.inverse('undo') if undo else Diff('redo', diff.indices, diff.before, diff.after)
+        self.grid.set_cells(diff.indices, diff.after)
+        return self.changed(diff.rect(self.width()), diff)
+
+    def copy_region(self, rect: Rect) -> 'Clip':
+        return Clip(self.grid.region(rect), [None] + self.tileset)
+
+    def paste(self, x: int, y: int, clip: 'Clip') -> Rect:
+        '''Pastes clip with its top left corner at (x, y), tiles of pasted cells missing from the tileset are added to it.
+
+        The diff lists the added tiles, undoing the paste removes them again.'''
+        rect = self.grid.clip(Rect(x, y, clip.grid.width, clip.grid.height))
+        if rect is None: return None
+        grid = clip.grid.region(Rect(rect.x - x, rect.y - y, rect.width, rect.height))
+        added = []
+        names = None
+        mapping = array('H', range(len(clip.tiles)))
+        for code in set(grid.data):
+            tile = clip.tiles[code]
+            if tile is None: continue
+            if tile not in self.codes:
+                if names is None:
+                    names = {t.name: t for t in self.tileset}
+                tile = self.pasted_tile(tile, names)
+                if tile not in self.codes:
+                    self.add_tile(tile)
+                    names[tile.name] = tile
+                    added += [tile]
+            mapping[code] = self.codes[tile]
+        if any(code != mapped for code, mapped in enumerate(mapping)):
+            grid = Grid.from_data(grid.width, grid.height, array('H', map(mapping.__getitem__, grid.data)))
+        before = self.grid.region(rect)
+        self.grid.blit(rect.x, rect.y, grid)
+        diff = Diff.between('paste', rect, self.width(), before, self.grid.region(rect))
+        diff.tiles = added
+        return self.changed(rect, diff)
+
+    def pasted_tile(self, tile: Tile, names: dict[str, Tile]) -> Tile:
+        '''Tile to paste in place of a tile of another room, names maps the names of the room tiles to them.
+
+        Project tiles are shared by the rooms, other tiles are cloned and renamed while their
+        name is taken. A room tile that only differs by such a name is used instead of a clone,
+        so pasting from the same room again doesn't add the tile again.'''
+        if tile.name not in names and any(t is tile for t in self.shared_tiles):
+            return tile
+        name = tile.name
+        n = 2
+        while name in names:
+            same = names[name]
+            if same.defn == tile.defn.replace(name=name):
+                return same
+            name = f'{tile.name}_{n}'
+            n += 1
+        result = tile.clone()
+        result.name = name
+        return result
+
+    def room_path(self, dir: str) -> str:
+        return path.abspath(path.join(dir, f'{self.name()}.json'))
+
+    def chunks_path(self, dir: str) -> str:
+        return path.abspath(path.join(dir, f'{self.name()}.chunks'))
+
+    def is_chunked(self) -> bool:
+        return isinstance(self.grid, ChunkedGrid)
+
+    def layout_encoding(self, encoding: str) -> str:
+        '''Encoding the room is saved with when the game uses encoding.'''
+        return 'chunks' if self.is_chunked() else encoding
+
+    def needs_save(self, dir: str, encoding: str) -> bool:
+        if self.dirty or self.origin != self.room_path(dir):
+            return True
+        # rooms that were never read have the encoding of the manifest they were listed in,
+        # reading them to find out whether they are chunked would load every room of the project
+        if not self.is_loaded():
+            return self.encoding != encoding
+        return self.encoding != self.layout_encoding(encoding)
+
+    def snapshot(self, dir: str, encoding: str, chunks: dict[tuple[int, int], array]=None, scripts: set[str]=None, shared: dict[Tile, int]=None, counts: dict=None) -> list['SaveFile']:
+        '''Captures the room and the scripts of its tiles that aren't stored in dir yet.
+
+        The returned files serialize the captured state and don't touch the room, so they
+        are safe to write from another thread. For chunked rooms chunks holds the edited
+        chunks taken from the grid and counts the value counts of the chunks stored afterwards. Scripts already in scripts are skipped, the scripts
+        that are added to the result are added to it. Tiles in shared are stored as
+        their index in the project tileset.'''
+        if scripts is None:
+            scripts = set()
+        if shared is None:
+            shared = {}
+        p = self.room_path(dir)
+        encoding = self.layout_encoding(encoding)
+        result = []
+        codes = tile_codes(len(self.tileset))
+        header = {}
+        code_width = len(codes[0]) if len(codes) > 0 else 1
+        if code_width > 1 or encoding != 'plain':
+            header['version'] = ROOM_VERSION
+            header['code_width'] = code_width
+        if encoding != 'plain':
+            header['layout_encoding'] = encoding
+        tileset_j = {}
+        for code, tile in zip(codes, self.tileset):
+            if tile in shared:
+                tileset_j[code] = {'shared': shared[tile]}
+                continue
+            tileset_j[code] = tile.to_json()
+            result += script_files(tile, dir, scripts)
+        header['tileset'] = tileset_j
+        if encoding == 'chunks':
+            grid = self.grid
+            chunks_dir = self.chunks_path(dir)
+            header['width'] = grid.width
+            header['height'] = grid.height
+            header['chunk_size'] = grid.chunk_size
+            header['chunks'] = path.basename(chunks_dir)
+            for key, data in chunks.items():
+                result += [SaveFile(path.join(chunks_dir, chunk_file(key)), lambda f, data=data: f.write(encode_chunk(data)), True)]
+            if grid.dir is not None and path.abspath(grid.dir) != chunks_dir:
+                for key in grid.stored - chunks.keys():
+                    src = path.join(grid.dir, chunk_file(key))
+                    result += [SaveFile(path.join(chunks_dir, chunk_file(key)), lambda f, src=src: f.write(open(src, 'rb').read()), True)]
+            if counts is not None:
+                # written after the chunks so it never describes chunks that failed to be written
+                result += [SaveFile(path.join(chunks_dir, COUNTS_FILE), text_writer(encode_counts(counts)))]
+            result += [SaveFile(p, text_writer(json.dumps(header, indent=4)))]
+            return result
+        grid = self.grid.copy()
+        codes = [''] + codes
+        result += [SaveFile(p, lambda f: write_room(f, header, grid, codes, encoding))]
+        return result
+
     def can_save(self):
-        for i in range(len(self.layout)):
-            for j in range(len(self.layout[i])):
-                if self.layout[i][j] is None:
-                    return f'Tile at ({j}, {i}) is not set at room {self.name()}'
+        if len(self.tileset) > MAX_TILES:
+            return f'Room {self.name()} has more than {MAX_TILES} tiles'
+        if self._index is not None:
+            i = self._index.first(UNSET)
+        else:
+            # building the index just for this would read every cell, find_unset scans
+            # the array directly and skips saved chunks, which can't hold unset cells
+            i = self.grid.find_unset()
+        if i == -1:
+            return None
+        return f'Tile at ({i % self.width()}, {i // self.width()}) is not set at room {self.name()}'
+
+def script_files(tile: Tile, dir: str, scripts: set[str]) -> list['SaveFile']:
+    '''The script file of tile unless it is in scripts or stored in dir already.'''
+    if tile.script == '': return []
+    sp = path.join(dir, tile.defn.script_path())
+    if sp in scripts: return []
+    scripts.add(sp)
+    if path.exists(sp): return []
+    return [SaveFile(sp, text_writer(tile.script))]
+
+def text_writer(text: str) -> callable:
+    return lambda f: f.write(text)
+
+def write_room(f, header: dict, grid: Grid, codes: list[str], encoding: str='plain'):
+    '''Streams the room to f row by row.
+
+    The output is the same text json.dumps({**header, 'layout': ...}, indent=4) produces,
+    codes are alphanumeric so layout rows need no escaping.'''
+    f.write('{\n')
+    for key, value in header.items():
+        f.write(f'    {json.dumps(key)}: ')
+        f.write(json.dumps(value, indent=4).replace('\n', '\n    '))
+        f.write(',\n')
+    f.write('    "layout": "')
+    for y in range(grid.height):
+        if encoding == 'rle':
+            f.write(encode_rle_row(grid.row(y), codes))
+        else:
+            f.write(''.join(map(codes.__getitem__, grid.row(y))))
+        f.write('\\n')
+    f.write('"\n}')
+
+def write_atomic(p: str, write: callable, binary: bool=False):
+    '''Writes to a temporary file next to p and renames it over p once it is complete.'''
+    mode = os.stat(p).st_mode & 0o777 if path.exists(p) else 0o644
+    fd, tmp = tempfile.mkstemp(prefix=path.basename(p) + '.', suffix='.tmp', dir=path.dirname(p))
+    try:
+        os.chmod(tmp, mode)
+        # project files are utf-8 whatever the locale, script text may hold any character
+        with os.fdopen(fd, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, p)
+    except BaseException:
+        if path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+class SaveFile:
+    '''File written by a save, write serializes captured state to the opened file.'''
+
+    def __init__(self, path: str, write: callable, binary: bool=False) -> None:
+        self.path: str = path
+        self.write: callable = write
+        self.binary: bool = binary
+
+class SavePlan:
+    '''Snapshot of everything a save has to write.
+
+    run only does file I/O, so it can be executed on a worker thread while the model
+    keeps being edited, finish has to be called on the thread that owns the model.'''
+
+    def __init__(self, game: 'Game', p: str) -> None:
+        self.game: Game = game
+        self.path: str = p
+        self.rooms_path: str = path.join(p, 'rooms')
+        self.encoding: str = game.layout_encoding()
+        self.files: list[SaveFile] = []
+        self.manifest: str = ''
+        self.rooms: list[Room] = []
+        # scripts that are either stored already or written by this save
+        self.scripts: set[str] = set()
+        # project tileset index of every shared tile and the tileset file contents
+        self.shared: dict[Tile, int] = {tile: i for i, tile in enumerate(game.tileset)}
+        self.tileset: str = None
+        # chunked grids with their new chunk directory, the chunks taken from them, the chunks that end up stored and their counts
+        self.chunked: list[tuple[ChunkedGrid, str, set, set, dict]] = []
+        self.written: list[str] = []
+
+    def add_room(self, room: Room):
+        chunks = None
+        counts = None
+        if room.is_chunked():
+            chunks = room.grid.take_dirty()
+            counts = room.grid.counts_with(chunks)
+            self.chunked += [(room.grid, room.chunks_path(self.rooms_path), set(chunks), room.grid.stored | chunks.keys(), counts)]
+        with PROFILER.span('snapshot room', room=room.name()):
+            self.files += room.snapshot(self.rooms_path, self.encoding, chunks, self.scripts, self.shared, counts)
+        self.rooms += [room]
+        # the snapshot is taken, edits made from now on belong to the next save
+        room.dirty = False
+
+    def run(self, progress: callable=None) -> None|str:
+        total = len(self.files) + 1
+        try:
+            os.makedirs(path.join(self.rooms_path, 'scripts'), exist_ok=True)
+            for _, dir, _, _, _ in self.chunked:
+                os.makedirs(dir, exist_ok=True)
+            for i, f in enumerate(self.files):
+                with PROFILER.span('write file', path=f.path):
+                    write_atomic(f.path, f.write, f.binary)
+                self.written += [f.path]
+                if progress is not None:
+                    progress(i + 1, total)
+            if self.tileset is not None:
+                tileset_p = path.join(self.path, SHARED_TILESET)
+                if not path.exists(tileset_p) or open(tileset_p, 'r', encoding='utf-8').read() != self.tileset:
+                    with PROFILER.span('write file', path=tileset_p):
+                        write_atomic(tileset_p, text_writer(self.tileset))
+                    self.written += [tileset_p]
+            manifest_p = path.join(self.path, 'manifest.json')
+            if not path.exists(manifest_p) or open(manifest_p, 'r', encoding='utf-8').read() != self.manifest:
+                with PROFILER.span('write file', path=manifest_p):
+                    write_atomic(manifest_p, text_writer(self.manifest))
+                self.written += [manifest_p]
+            if progress is not None:
+                progress(total, total)
+        except Exception as e:
+            # anything that stops the save has to reach finish so the rooms are saved again
+            return f'Failed to save {self.path}: {e}'
         return None
 
+    def finish(self, err: None|str):
+        if err is not None:
+            for room in self.rooms:
+                room.dirty = True
+            for grid, _, taken, _, _ in self.chunked:
+                grid.save_failed(taken)
+        else:
+            for room in self.rooms:
+                room.origin = room.room_path(self.rooms_path)
+                room.encoding = room.layout_encoding(self.encoding)
+            for grid, dir, taken, stored, counts in self.chunked:
+                grid.saved(dir, stored, taken, counts)
+        self.game.last_written = self.written
+
+class Clip:
+    '''Rectangular piece of a room layout along with the tiles its codes refer to.'''
+
+    def __init__(self, grid: Grid, tiles: list[Tile]) -> None:
+        self.grid: Grid = grid
+        self.tiles: list[Tile] = tiles
+
 class Game:
     def __init__(self) -> None:
         self.name: lambda: str = None
@@ -90,8 +862,15 @@ class Game:
         self.spawn_room: Room = None
         self.spawn_x_loc: lambda: int = None
         self.spawn_y_loc: lambda: int = None
-        
+        self.layout_encoding: lambda: str = lambda: 'plain'
+
         self.rooms: list[Room] = list()
+        # tiles shared by all rooms, rooms add them to their tilesets like their own tiles
+        self.tileset: list[Tile] = []
+        # definitions of all tiles of the project
+        self.defs: TileDefs = TileDefs()
+        # files written by the last save
+        self.last_written: list[str] = []
 
     def exists_room_with_name(self, name: str):
         for r in self.rooms:
@@ -99,7 +878,29 @@ class Game:
                 return True
         return False
 
-    def save(self, p: str) -> None|str:
+    def bind_loaded(self):
+        '''Binds the values read by load to the game and its rooms, for use without the editor.'''
+        name = self.temp_name
+        description = self.temp_description
+        project_name = self.temp_project_name
+        layout_encoding = self.temp_layout_encoding
+        x = self.spawn_temp_x_loc
+        y = self.spawn_temp_y_loc
+        self.name = lambda: name
+        self.description = lambda: description
+        self.project_name = lambda: project_name
+        self.layout_encoding = lambda: layout_encoding
+        self.spawn_x_loc = lambda: x
+        self.spawn_y_loc = lambda: y
+        del self.temp_name, self.temp_description, self.temp_project_name, self.temp_layout_encoding
+        del self.spawn_temp_x_loc, self.spawn_temp_y_loc
+        for room in self.rooms:
+            n = room.temp_name
+            del room.temp_name
+            room.name = lambda n=n: n
+
+    def validate(self) -> None|str:
+        '''Returns why the game can't be saved, None if it can.'''
         project_name = self.project_name()
         if project_name is None:
             return 'No project name specified'
@@ -116,6 +917,26 @@ class Game:
         if self.spawn_y_loc is None or self.spawn_x_loc() < 0:
             return 'Spawn Y location not specified'
 
+        if self.layout_encoding() not in LAYOUT_ENCODINGS:
+            return f'Unknown layout encoding {self.layout_encoding()}'
+
+        # rooms that were never opened are unchanged since they were loaded
+        with PROFILER.span('validate rooms'):
+            for r in self.rooms:
+                if not r.is_loaded(): continue
+                err = r.can_save()
+                if err is not None:
+                    return err
+        return None
+
+    def plan_save(self, p: str) -> 'SavePlan|str':
+        '''Validates the game and captures what has to be written to p, returns an error message on failure.'''
+        err = self.validate()
+        if err is not None:
+            return err
+
+        name = self.name()
+        project_name = self.project_name()
         j = {}
         j['name'] = name
         j['project_name'] = project_name
@@ -125,77 +946,91 @@ class Game:
         spawn_j['x_loc'] = self.spawn_x_loc()
         spawn_j['y_loc'] = self.spawn_y_loc()
         j['spawn'] = spawn_j
+        layout_encoding = self.layout_encoding()
+        if layout_encoding != 'plain':
+            j['layout_encoding'] = layout_encoding
 
-        for r in self.rooms:
-            err = r.can_save()
-            if err is not None:
-                return err
-                
-        os.makedirs(p, exist_ok=True)
-        rooms_p = path.join(p, 'rooms')
-        os.makedirs(rooms_p, exist_ok=True)
+        result = SavePlan(self, p)
+        if len(self.tileset) > 0:
+            j['tileset'] = SHARED_TILESET
+            result.tileset = json.dumps([tile.to_json() for tile in self.tileset], indent=4)
+            for tile in self.tileset:
+                result.files += script_files(tile, result.rooms_path, result.scripts)
         rooms_j = {}
         for r in self.rooms:
-            os.makedirs(path.join(rooms_p, 'scripts'), exist_ok=True)
-            err = r.save(rooms_p)
-            if err is not None:
-                return err
             r_name = r.name()
             rooms_j[r_name] = path.join('rooms', f'{r_name}.json')
+            if r.needs_save(result.rooms_path, layout_encoding):
+                result.add_room(r)
         j['rooms'] = rooms_j
+        result.manifest = json.dumps(j, indent=4)
+        return result
 
-        open(path.join(p, 'manifest.json'), 'w').write(json.dumps(j, indent=4))
+    def save(self, p: str) -> None|str:
+        with PROFILER.span('plan save'):
+            plan = self.plan_save(p)
+        if isinstance(plan, str):
+            return plan
+        with PROFILER.span('write save', files=len(plan.files)):
+            err = plan.run()
+        plan.finish(err)
+        return err
 
-    def load(dir: str):
+    def load(dir: str, lazy: bool=False, workers: int=0, cache: bool=True):
+        '''Loads the project at dir.
+
+        With lazy set rooms are only read once their contents are accessed, otherwise
+        with workers > 0 rooms are read and decoded in parallel. With cache set rooms
+        are read from the binary cache in dir when their files haven't changed.'''
+        with PROFILER.span('load project', dir=dir, lazy=lazy, workers=workers):
+            return Game.load_project(dir, lazy, workers, cache)
+
+    def load_project(dir: str, lazy: bool, workers: int, cache: bool) -> 'Game':
         result = Game()
-        game_info = json.loads(open(path.join(dir, 'manifest.json'), 'r').read())
+        room_cache = RoomCache(dir) if cache else None
+        with PROFILER.span('parse manifest'):
+            game_info = json.loads(open(path.join(dir, 'manifest.json'), 'r', encoding='utf-8').read())
         spawn = game_info['spawn']
 
         result.temp_name = game_info['name']
         result.temp_description = game_info['description']
         result.temp_project_name = game_info['project_name']
+        result.temp_layout_encoding = game_info.get('layout_encoding', 'plain')
 
         result.spawn_temp_x_loc = spawn['x_loc']
-        result.spawn_temp_y_loc = spawn['x_loc']
+        result.spawn_temp_y_loc = spawn['y_loc']
+
+        if 'tileset' in game_info:
+            with PROFILER.span('load shared tileset'):
+                tileset_j = json.loads(read_text(path.join(dir, game_info['tileset'])))
+                for tile_j in tileset_j:
+                    result.tileset += [Tile.load(tile_j, path.join(dir, 'rooms'), defs=result.defs)]
 
         rooms_j = game_info['rooms']
+        pending = []
         for room_name, rpath in rooms_j.items():
-
-            room_path = path.join(dir, rpath)
-            room_data = json.loads(open(room_path, 'r').read())
             room = Room()
+            room.shared_tiles = result.tileset
+            room.defs = result.defs
             room.temp_name = room_name
-            actual_d = {}
-            # construct tileset
-            for tile_c, tile_j in room_data['tileset'].items():
-                tile = Tile()
-                tile.name = tile_j['name']
-                tile.display_name = tile_j['display_name']
-                tile.seethrough = tile_j['seethrough']
-                tile.passable = tile_j['passable']
-                tile.image_path = 'error.png'
-                if 'image_path' in tile_j:
-                    tile.image_path = tile_j['image_path']
-                if 'events' in tile_j:
-                    events = tile_j['events']
-                    tile.script = open(path.join(path.dirname(room_path), events['script']), 'r').read()
-                    if 'interact' in events:
-                        tile.interact_func = events['interact']
-                    if 'step' in events:
-                        tile.step_func = events['step']
-                actual_d[tile_c] = tile
-                room.tileset += [tile]
-            # fill layout
-            for row in room_data['layout'].split('\n'):
-                if row == '': continue
-                r = []
-                for c in row:
-                    r += [actual_d[c]]
-                room.layout += [r]
+            room_path = path.join(dir, rpath)
+            room.origin = path.abspath(room_path)
+            room.dirty = False
+            room.cache = room_cache
+            if lazy:
+                room.source = room_path
+                # saves write every room that isn't chunked with the encoding of the manifest
+                room.encoding = result.temp_layout_encoding
+            elif workers > 0:
+                pending += [(room, room_path)]
+            else:
+                room.read(room_path)
             # add room to list
             result.rooms += [room]
             # set spawn room
             if room_name == spawn['room_name']:
                 result.spawn_room = room
-
+        if len(pending) > 0:
+            with PROFILER.span('load rooms parallel', rooms=len(pending)):
+                load_rooms_parallel(pending, workers, room_cache)
         return result
\ No newline at end of file
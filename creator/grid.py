@@ -0,0 +1,337 @@
+from array import array
+from collections import Counter
+
+# value stored in cells that have no tile assigned
+UNSET = 0
+
+class Rect:
+    def __init__(self, x: int, y: int, width: int, height: int) -> None:
+        self.x: int = x
+        self.y: int = y
+        self.width: int = width
+        self.height: int = height
+
+    def from_points(x1: int, y1: int, x2: int, y2: int) -> 'Rect':
+        return Rect(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+
+    def union(self, other: 'Rect') -> 'Rect':
+        if other is None: return self
+        x = min(self.x, other.x)
+        y = min(self.y, other.y)
+        x2 = max(self.x + self.width, other.x + other.width)
+        y2 = max(self.y + self.height, other.y + other.height)
+        return Rect(x, y, x2 - x, y2 - y)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Rect): return False
+        return (self.x, self.y, self.width, self.height) == (other.x, other.y, other.width, other.height)
+
+    def __repr__(self) -> str:
+        return f'Rect({self.x}, {self.y}, {self.width}, {self.height})'
+
+class Diff:
+    '''Cells changed by an edit as flat indices along with their values before and after it.
+
+    action names the edit, consecutive paint diffs may be merged into one undo step.'''
+
+    def __init__(self, action: str, indices: array=None, before: array=None, after: array=None) -> None:
+        self.action: str = action
+        self.indices: array = array('I') if indices is None else indices
+        self.before: array = array('H') if before is None else before
+        self.after: array = array('H') if after is None else after
+        # tiles the edit appended to the tileset, the codes in after may refer to them
+        self.tiles: list = []
+
+    def between(action: str, rect: Rect, width: int, before: 'Grid', after: 'Grid') -> 'Diff':
+        '''Diff of the cells in rect, before and after holding the rect contents of a width wide grid.'''
+        result = Diff(action)
+        for i, (b, a) in enumerate(zip(before.data, after.data)):
+            if b != a:
+                result.indices.append((rect.y + i // rect.width) * width + rect.x + i % rect.width)
+                result.before.append(b)
+                result.after.append(a)
+        return result
+
+    def inverse(self, action: str) -> 'Diff':
+        return Diff(action, self.indices, self.after, self.before)
+
+    def merge(self, later: 'Diff') -> 'Diff':
+        '''Single diff with the effect of this diff followed by later.'''
+        cells = {}
+        for i, b, a in zip(self.indices, self.before, self.after):
+            cells[i] = [b, a]
+        for i, b, a in zip(later.indices, later.before, later.after):
+            if i in cells:
+                cells[i][1] = a
+            else:
+                cells[i] = [b, a]
+        result = Diff(self.action)
+        for i, (b, a) in cells.items():
+            if b == a: continue
+            result.indices.append(i)
+            result.before.append(b)
+            result.after.append(a)
+        return result
+
+    def rect(self, width: int) -> Rect:
+        if len(self.indices) == 0: return None
+        ys = [i // width for i in self.indices]
+        xs = [i % width for i in self.indices]
+        return Rect.from_points(min(xs), min(ys), max(xs), max(ys))
+
+    def nbytes(self) -> int:
+        return sum(len(a) * a.itemsize for a in (self.indices, self.before, self.after))
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+def find_all(data: array, value: int, start: int=0, stop: int=None) -> list[int]:
+    '''Indices of the items of data[start:stop] equal to value.'''
+    if stop is None: stop = len(data)
+    result = []
+    i = start - 1
+    while True:
+        try:
+            i = data.index(value, i + 1, stop)
+        except ValueError:
+            return result
+        result += [i]
+
+class CellIndex:
+    '''Number of cells holding each value along with the parts of the grid that may hold it.
+
+    Parts are the rows of a Grid and the chunks of a ChunkedGrid. Counts are kept up to
+    date from the diffs of edits, parts are only added by them and dropped once positions
+    finds them empty, so listing the cells of a value only scans parts that held it.'''
+
+    def __init__(self, grid: 'Grid') -> None:
+        self.grid: Grid = grid
+        self.counts: dict[int, int] = {}
+        self.parts: dict[int, set] = {}
+        for part, counts in grid.part_counts():
+            for value, n in counts.items():
+                self.counts[value] = self.counts.get(value, 0) + n
+                self.parts.setdefault(value, set()).add(part)
+
+    def update(self, diff: Diff):
+        part_of = self.grid.part_of
+        for i, b, a in zip(diff.indices, diff.before, diff.after):
+            self.counts[b] -= 1
+            self.counts[a] = self.counts.get(a, 0) + 1
+            self.parts.setdefault(a, set()).add(part_of(i))
+
+    def remove(self, value: int):
+        '''Forgets value, which no cell may hold anymore.'''
+        self.counts.pop(value, None)
+        self.parts.pop(value, None)
+
+    def count(self, value: int) -> int:
+        return self.counts.get(value, 0)
+
+    def cells(self, value: int, first: bool=False) -> list[int]:
+        '''Flat indices of the cells holding value, only those of one part when first is set.'''
+        parts = self.parts.get(value)
+        if parts is None: return []
+        if self.count(value) == 0:
+            del self.parts[value]
+            return []
+        result = []
+        for part in sorted(parts):
+            cells = self.grid.part_cells(part, value)
+            if len(cells) == 0:
+                parts.discard(part)
+                continue
+            result += cells
+            if first: break
+        return result
+
+    def first(self, value: int) -> int:
+        '''Flat index of a cell holding value, -1 if there is none.'''
+        cells = self.cells(value, first=True)
+        return cells[0] if len(cells) > 0 else -1
+
+    def positions(self, value: int, rect: 'Rect'=None) -> list[tuple[int, int]]:
+        '''(x, y) of every cell holding value, only those inside rect when it is given.'''
+        w = self.grid.width
+        if rect is None:
+            return [(i % w, i // w) for i in self.cells(value)]
+        result = []
+        x2 = rect.x + rect.width
+        y2 = rect.y + rect.height
+        for part in sorted(self.grid.parts_in(rect) & self.parts.get(value, set())):
+            for i in self.grid.part_cells(part, value):
+                y, x = divmod(i, w)
+                if rect.x <= x < x2 and rect.y <= y < y2:
+                    result += [(x, y)]
+        return result
+
+class Grid:
+    '''Row-major width x height grid of uint16 tile indices.'''
+
+    def __init__(self, width: int=0, height: int=0, value: int=UNSET) -> None:
+        self.width: int = width
+        self.height: int = height
+        self.data: array = array('H', [value]) * (width * height)
+
+    def from_data(width: int, height: int, data: array) -> 'Grid':
+        if len(data) != width * height:
+            raise ValueError(f'Expected {width * height} cells, got {len(data)}')
+        result = Grid()
+        result.width = width
+        result.height = height
+        result.data = data
+        return result
+
+    def get(self, x: int, y: int) -> int:
+        return self.data[y * self.width + x]
+
+    def set(self, x: int, y: int, value: int) -> int:
+        i = y * self.width + x
+        old = self.data[i]
+        self.data[i] = value
+        return old
+
+    def row(self, y: int, x1: int=0, x2: int=None) -> array:
+        o = y * self.width
+        if x2 is None: x2 = self.width
+        return self.data[o + x1:o + x2]
+
+    def find(self, value: int) -> int:
+        '''Flat index of the first cell holding value, -1 if there is none.'''
+        try:
+            return self.data.index(value)
+        except ValueError:
+            return -1
+
+    def find_unset(self) -> int:
+        return self.find(UNSET)
+
+    def count(self, value: int) -> int:
+        return self.data.count(value)
+
+    # parts of a Grid are its rows
+    def part_counts(self):
+        '''Parts of the grid along with the number of cells holding each value in them.'''
+        w = self.width
+        for y in range(self.height):
+            yield y, Counter(self.data[y * w:(y + 1) * w])
+
+    def part_of(self, i: int) -> int:
+        return i // self.width
+
+    def parts_in(self, rect: Rect) -> 'set[int]':
+        rect = self.clip(rect)
+        if rect is None: return set()
+        return set(range(rect.y, rect.y + rect.height))
+
+    def part_cells(self, y: int, value: int) -> list[int]:
+        return find_all(self.data, value, y * self.width, (y + 1) * self.width)
+
+    def set_cells(self, indices: array, values: array):
+        data = self.data
+        for i, value in zip(indices, values):
+            data[i] = value
+
+    def copy(self) -> 'Grid':
+        return Grid.from_data(self.width, self.height, array('H', self.data))
+
+    def nbytes(self) -> int:
+        return len(self.data) * self.data.itemsize
+
+    def clip(self, rect: Rect) -> Rect:
+        '''Part of rect that lies inside the grid, None if they don't overlap.'''
+        x1 = max(rect.x, 0)
+        y1 = max(rect.y, 0)
+        x2 = min(rect.x + rect.width, self.width)
+        y2 = min(rect.y + rect.height, self.height)
+        if x1 >= x2 or y1 >= y2:
+            return None
+        return Rect(x1, y1, x2 - x1, y2 - y1)
+
+    def fill(self, rect: Rect, value: int) -> Rect:
+        rect = self.clip(rect)
+        if rect is None: return None
+        run = array('H', [value]) * rect.width
+        o = rect.y * self.width + rect.x
+        for _ in range(rect.height):
+            self.data[o:o + rect.width] = run
+            o += self.width
+        return rect
+
+    def region(self, rect: Rect) -> 'Grid':
+        rect = self.clip(rect)
+        if rect is None: return Grid()
+        data = array('H')
+        o = rect.y * self.width + rect.x
+        for _ in range(rect.height):
+            data += self.data[o:o + rect.width]
+            o += self.width
+        return Grid.from_data(rect.width, rect.height, data)
+
+    def blit(self, x: int, y: int, other: 'Grid') -> Rect:
+        rect = self.clip(Rect(x, y, other.width, other.height))
+        if rect is None: return None
+        sx = rect.x - x
+        for row in range(rect.y - y, rect.y - y + rect.height):
+            so = row * other.width + sx
+            o = (row + y) * self.width + rect.x
+            self.data[o:o + rect.width] = other.data[so:so + rect.width]
+        return rect
+
+    def replace(self, old: int, new: int, changed: array=None) -> Rect:
+        '''Replaces every old cell with new, the flat indices of the replaced cells are appended to changed.'''
+        if old == new: return None
+        i = self.find(old)
+        if i == -1: return None
+        data = self.data
+        w = self.width
+        x1 = w
+        x2 = 0
+        y1 = i // w
+        while True:
+            data[i] = new
+            if changed is not None: changed.append(i)
+            x = i % w
+            if x < x1: x1 = x
+            if x > x2: x2 = x
+            try:
+                i = data.index(old, i + 1)
+            except ValueError:
+                break
+        return Rect(x1, y1, x2 - x1 + 1, i // w - y1 + 1)
+
+    def flood_fill(self, x: int, y: int, value: int, changed: array=None) -> Rect:
+        '''Scanline fill of the 4-connected area of equal cells around (x, y).
+
+        The flat indices of the filled cells are appended to changed.'''
+        data = self.data
+        w = self.width
+        target = data[y * w + x]
+        if target == value: return None
+        result = None
+        stack = [(x, y)]
+        while stack:
+            x, y = stack.pop()
+            o = y * w
+            if data[o + x] != target: continue
+            l = x
+            while l > 0 and data[o + l - 1] == target:
+                l -= 1
+            r = x
+            while r < w - 1 and data[o + r + 1] == target:
+                r += 1
+            data[o + l:o + r + 1] = array('H', [value]) * (r - l + 1)
+            if changed is not None: changed.extend(range(o + l, o + r + 1))
+            result = Rect(l, y, r - l + 1, 1).union(result)
+            for ny in (y - 1, y + 1):
+                if ny < 0 or ny >= self.height: continue
+                no = ny * w
+                inside = False
+                for nx in range(l, r + 1):
+                    if data[no + nx] == target:
+                        if not inside:
+                            stack += [(nx, ny)]
+                            inside = True
+                    else:
+                        inside = False
+        return result
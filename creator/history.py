@@ -0,0 +1,248 @@
+import time
+from collections import deque
+
+from game import Game, Room, Tile
+from grid import Diff, Rect
+
+# default limit for the memory taken by the undo stack
+HISTORY_BYTES = 32 * 1024 * 1024
+# consecutive paints closer together than this are undone as one step
+COALESCE_SECONDS = 1.0
+# rough size of an edit that doesn't hold cells
+EDIT_BYTES = 64
+
+class CellsEdit:
+    def __init__(self, room: Room, diff: Diff) -> None:
+        self.room: Room = room
+        self.diff: Diff = diff
+        # codes of the tiles the edit added
+        self.codes: list[int] = [room.code_of(tile) for tile in diff.tiles]
+        self.time: float = time.monotonic()
+
+    def undo(self):
+        err = self.room.pop_error(self.codes)
+        if err is not None:
+            raise ValueError(err)
+        self.room.apply(self.diff, undo=True)
+        self.room.pop_tiles(self.codes)
+
+    def redo(self):
+        for tile in self.diff.tiles:
+            self.room.add_tile(tile)
+        self.room.apply(self.diff)
+
+    def merge(self, later) -> bool:
+        '''Folds a later edit into this one, returns whether it could be merged.'''
+        if not isinstance(later, CellsEdit) or later.room is not self.room: return False
+        if self.diff.action != 'paint' or later.diff.action != 'paint': return False
+        if later.time - self.time > COALESCE_SECONDS: return False
+        self.diff = self.diff.merge(later.diff)
+        self.time = later.time
+        return True
+
+    def nbytes(self) -> int:
+        return EDIT_BYTES + self.diff.nbytes() + sum(len(tile.script) for tile in self.diff.tiles)
+
+class TileEdit:
+    def __init__(self, room: Room, i: int, before: Tile, after: Tile) -> None:
+        self.room: Room = room
+        self.i: int = i
+        # clones of the tile, their definitions are immutable so they can't change afterwards
+        self.before: Tile = before
+        self.after: Tile = after
+
+    def undo(self):
+        self.room.edit_tile(self.i, self.before)
+
+    def redo(self):
+        self.room.edit_tile(self.i, self.after)
+
+    def merge(self, later) -> bool:
+        return False
+
+    def nbytes(self) -> int:
+        return EDIT_BYTES + len(self.before.script) + len(self.after.script)
+
+class TileAdd:
+    def __init__(self, room: Room, tile: Tile) -> None:
+        self.room: Room = room
+        self.tile: Tile = tile
+        self.code: int = room.code_of(tile)
+
+    def undo(self):
+        self.room.pop_tiles([self.code])
+
+    def redo(self):
+        self.room.add_tile(self.tile)
+
+    def merge(self, later) -> bool:
+        return False
+
+    def nbytes(self) -> int:
+        return EDIT_BYTES + len(self.tile.script)
+
+class TileReplace:
+    '''Swap of tileset[i] for another tile, such as overriding a project tile with a room copy.'''
+
+    def __init__(self, room: Room, i: int, before: Tile, after: Tile) -> None:
+        self.room: Room = room
+        self.i: int = i
+        self.before: Tile = before
+        self.after: Tile = after
+
+    def undo(self):
+        self.room.replace_tile(self.i, self.before)
+
+    def redo(self):
+        self.room.replace_tile(self.i, self.after)
+
+    def merge(self, later) -> bool:
+        return False
+
+    def nbytes(self) -> int:
+        return EDIT_BYTES
+
+class TileShare:
+    '''Addition of a room tile to the project tileset, the room file refers to it by index afterwards.'''
+
+    def __init__(self, game: Game, room: Room, tile: Tile) -> None:
+        self.game: Game = game
+        self.room: Room = room
+        self.tile: Tile = tile
+
+    def undo(self):
+        if len(self.game.tileset) == 0 or self.game.tileset[-1] is not self.tile:
+            raise ValueError(f'Tile {self.tile.name} is not the last tile of the project tileset')
+        self.game.tileset.pop()
+        self.room.dirty = True
+
+    def redo(self):
+        self.game.tileset.append(self.tile)
+        self.room.dirty = True
+
+    def merge(self, later) -> bool:
+        return False
+
+    def nbytes(self) -> int:
+        return EDIT_BYTES
+
+class RoomAdd:
+    def __init__(self, game: Game, room: Room, spawn_before: Room) -> None:
+        self.game: Game = game
+        self.room: Room = room
+        self.spawn_before: Room = spawn_before
+        self.spawn_after: Room = game.spawn_room
+
+    def undo(self):
+        self.game.rooms.remove(self.room)
+        self.game.spawn_room = self.spawn_before
+
+    def redo(self):
+        self.game.rooms += [self.room]
+        self.game.spawn_room = self.spawn_after
+
+    def merge(self, later) -> bool:
+        return False
+
+    def nbytes(self) -> int:
+        return EDIT_BYTES
+
+class ValueEdit:
+    '''Edit of a value that is changed through set, such as the spawn location.'''
+
+    def __init__(self, set: callable, before, after) -> None:
+        self.set: callable = set
+        self.before = before
+        self.after = after
+
+    def undo(self):
+        self.set(self.before)
+
+    def redo(self):
+        self.set(self.after)
+
+    def merge(self, later) -> bool:
+        return False
+
+    def nbytes(self) -> int:
+        return EDIT_BYTES
+
+class History:
+    '''Undo and redo stacks of edits.
+
+    Layout edits are recorded as the changed cells only, so undoing or redoing
+    one takes time proportional to the number of cells it changed. The oldest
+    edits are dropped once the undo stack takes more than max_bytes.'''
+
+    def __init__(self, max_bytes: int=HISTORY_BYTES) -> None:
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.undo_stack: deque = deque()
+        self.redo_stack: list = []
+        # set while an edit is undone or redone so the changes it makes aren't recorded
+        self.applying: bool = False
+
+    def push(self, edit):
+        if self.applying: return
+        self.redo_stack = []
+        if len(self.undo_stack) > 0:
+            last = self.undo_stack[-1]
+            size = last.nbytes()
+            if last.merge(edit):
+                self.size += last.nbytes() - size
+                self.trim()
+                return
+        self.undo_stack.append(edit)
+        self.size += edit.nbytes()
+        self.trim()
+
+    def trim(self):
+        while self.size > self.max_bytes and len(self.undo_stack) > 1:
+            self.size -= self.undo_stack.popleft().nbytes()
+
+    def room_changed(self, room: Room, rect: Rect, diff: Diff):
+        '''Room listener that records layout edits.'''
+        if len(diff) == 0: return
+        self.push(CellsEdit(room, diff))
+
+    def can_undo(self) -> bool:
+        return len(self.undo_stack) > 0
+
+    def can_redo(self) -> bool:
+        return len(self.redo_stack) > 0
+
+    def undo(self):
+        '''Undoes the last edit and returns it, None if there is nothing to undo.'''
+        if not self.can_undo(): return None
+        edit = self.undo_stack.pop()
+        self.size -= edit.nbytes()
+        self.applying = True
+        try:
+            edit.undo()
+        except Exception:
+            # edits check that they can be undone before changing anything, so the edit is kept
+            self.undo_stack.append(edit)
+            self.size += edit.nbytes()
+            raise
+        finally:
+            self.applying = False
+        self.redo_stack += [edit]
+        return edit
+
+    def redo(self):
+        if not self.can_redo(): return None
+        edit = self.redo_stack.pop()
+        self.applying = True
+        try:
+            edit.redo()
+        finally:
+            self.applying = False
+        self.undo_stack.append(edit)
+        self.size += edit.nbytes()
+        self.trim()
+        return edit
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.size = 0
@@ -0,0 +1,68 @@
+import os
+import os.path as path
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap
+
+from profiling import PROFILER
+
+class ImageCache:
+    '''Process-wide LRU cache of decoded and pre-scaled tile images.
+
+    Entries are keyed by the resolved image path, its modification time and
+    the requested size, so an image edited on disk is decoded again.'''
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.entries: OrderedDict[tuple, QPixmap] = OrderedDict()
+
+    def key(self, image_path: str, size: int) -> tuple:
+        real = path.realpath(image_path)
+        try:
+            mtime = os.stat(real).st_mtime_ns
+        except OSError:
+            mtime = None
+        return (real, mtime, size)
+
+    def get(self, image_path: str, size: int=None) -> QPixmap:
+        '''Returns the image at image_path, scaled to fit a size x size square if size is given.'''
+        key = self.key(image_path, size)
+        result = self.entries.get(key)
+        if result is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+        self.misses += 1
+        if size is None:
+            with PROFILER.span('load pixmap', path=key[0]):
+                result = QPixmap(key[0])
+        else:
+            result = self.get(image_path)
+            if not result.isNull():
+                with PROFILER.span('scale pixmap', size=size):
+                    result = result.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.put(key, result)
+        return result
+
+    def put(self, key: tuple, pixmap: QPixmap):
+        self.entries[key] = pixmap
+        self.size += pixmap_bytes(pixmap)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= pixmap_bytes(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> str:
+        return f'{len(self.entries)} images, {self.size // 1024} KiB, {self.hits} hits, {self.misses} misses'
+
+def pixmap_bytes(pixmap: QPixmap) -> int:
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+IMAGE_CACHE = ImageCache(64 * 1024 * 1024)
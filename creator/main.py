@@ -2,42 +2,108 @@
 
 import os
 import sys
+import time
+# time to first window is measured from here, before the Qt and project imports
+STARTED_NS = time.perf_counter_ns()
+
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
-from luaparser import ast, astnodes, builder
-
-from PyQt5.Qsci import QsciScintilla, QsciLexerLua
-
-from game import Game, Room, Tile
+from atlas import TileAtlas
+from game import Clip, Game, Room, SavePlan, Tile, LAYOUT_ENCODINGS
+from grid import Diff, Rect
+from history import CellsEdit, History, RoomAdd, TileAdd, TileEdit, TileReplace, TileShare, ValueEdit
+from images import IMAGE_CACHE
+from profiling import PROFILER, PROFILE_ENV
+from scripts import SCRIPT_CACHE, ScriptInfo, analyze, script_key
 
 
 TILE_HW = 32
+THUMB_HW = 48
 BASE_COLOR = QColor('gray')
 SELECTED_COLOR = QColor('red')
 MIN_TILES_X = 21
 MIN_TILES_Y = 21
+# cell sizes the room view can be zoomed to
+ZOOM_HWS = [1, 2, 4, 8, 16, 32, 64]
+# cells at most this wide are drawn as one raster image built from the atlas
+RASTER_MAX_HW = 4
+# cell borders are only drawn when cells are at least this wide
+GRID_MIN_HW = 8
+# rooms whose raster at the current zoom fits in this many bytes keep it between paints
+RASTER_BYTES = 64 * 1024 * 1024
+# edits changing more cells are repainted by their bounding rect
+MAX_UPDATE_CELLS = 256
+# scripts are analyzed once typing pauses for this long
+PARSE_DELAY_MS = 400
+# set to quit right after the first paint, used by bench.startup to measure startup
+EXIT_AFTER_START_ENV = 'TILED_EXIT_AFTER_START'
+
+class ParseSignals(QObject):
+    finished = pyqtSignal(str, object)
+
+class ParseTask(QRunnable):
+    '''Analyzes a script on a pool thread, the result is reported through a queued signal.'''
+
+    def __init__(self, text: str, key: str) -> None:
+        super().__init__()
+        self.text = text
+        self.key = key
+        self.signals = ParseSignals()
 
-class ScriptWidget(QsciScintilla):
-    def __init__(self, parent) -> None:
-        super().__init__(parent)
+    def run(self):
+        self.signals.finished.emit(self.key, analyze(self.text))
 
-        lexer = QsciLexerLua()
-        self.setLexer(lexer)
-        self.setAutoIndent(True)
-        # self.setAutoCompletionSource()
-        
-        self.setMinimumSize(600, 450)
+class WarmUpTask(QRunnable):
+    '''Imports the script parser on a pool thread once the window is up, so the first tile edit doesn't wait for it.'''
+
+    def run(self):
+        analyze('')
+
+class ScriptAnalyzer(QObject):
+    '''Runs script analysis in the background, results are added to SCRIPT_CACHE and passed to done.'''
+
+    def __init__(self, done: callable) -> None:
+        super().__init__()
+        self.done = done
+        self.tasks: dict[str, ParseTask] = {}
+
+    def request(self, text: str):
+        '''done is called right away if the analysis of text is cached.'''
+        key = script_key(text)
+        info = SCRIPT_CACHE.get(key)
+        if info is not None:
+            self.done(key, info)
+            return
+        if key in self.tasks: return
+        task = ParseTask(text, key)
+        task.signals.finished.connect(self.finished)
+        self.tasks[key] = task
+        QThreadPool.globalInstance().start(task)
+
+    def finished(self, key: str, info: ScriptInfo):
+        del self.tasks[key]
+        SCRIPT_CACHE.put(key, info)
+        self.done(key, info)
 
 class ScriptEditor(QDialog):
     def __init__(self, parent) -> None:
         super().__init__(parent)
         self.setWindowTitle('Tile script editing')
         self.saved = False
+        self.analyzer = ScriptAnalyzer(self.analyzed)
+        self.key: str = None
+        # restarted on every change so the script is only parsed once typing pauses
+        self.parse_timer = QTimer(self)
+        self.parse_timer.setSingleShot(True)
+        self.parse_timer.timeout.connect(self.analyze)
         self.initUI()
 
     def initUI(self):
+        # QScintilla is only loaded once a script is edited
+        from script_widget import ScriptWidget
+
         main_layout = QVBoxLayout()
 
         buttons_layout = QHBoxLayout()
@@ -47,8 +113,12 @@ class ScriptEditor(QDialog):
         font = QFont()
         font.setPointSize(18)
         self.script_edit.setFont(font)
+        self.script_edit.textChanged.connect(lambda: self.parse_timer.start(PARSE_DELAY_MS))
         main_layout.addWidget(self.script_edit)
 
+        self.status_label = QLabel()
+        main_layout.addWidget(self.status_label)
+
         save_button = QPushButton('Save')
         save_button.clicked.connect(self.save_action)
         buttons_layout.addWidget(save_button)
@@ -65,17 +135,27 @@ class ScriptEditor(QDialog):
 
     def load(self, text: str):
         self.script_edit.setText(text)
+        self.analyze()
+
+    def analyze(self):
+        self.parse_timer.stop()
+        text = self.script_edit.text()
+        self.key = script_key(text)
+        self.status_label.setText('Parsing...')
+        self.analyzer.request(text)
+
+    def analyzed(self, key: str, info: ScriptInfo):
+        if key != self.key: return
+        if info.error is not None:
+            self.status_label.setText(f'Parsing error: {info.error}')
+        else:
+            self.status_label.setText('Functions: ' + ', '.join(info.functions))
 
-    def unload(self):
-        self.script_edit.setText('')
-    
     # actions
     def save_action(self):
-        try:
-            text = self.script_edit.text()
-            ast.parse(text)
-        except builder.SyntaxException as e:
-            QMessageBox.critical(self, 'Lua parcing error', f'Parsing error:\n\n{str(e)}')
+        info = SCRIPT_CACHE.analyze(self.script_edit.text())
+        if info.error is not None:
+            QMessageBox.critical(self, 'Lua parcing error', f'Parsing error:\n\n{info.error}')
             return
         self.saved = True
 
@@ -85,114 +165,301 @@ class ScriptEditor(QDialog):
         self.saved = False
         self.close()
 
+class SaveSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+
+class SaveTask(QRunnable):
+    '''Writes a save plan on a pool thread, progress is reported through queued signals.'''
+
+    def __init__(self, plan: SavePlan) -> None:
+        super().__init__()
+        self.plan = plan
+        self.signals = SaveSignals()
+
+    def run(self):
+        err = 'The save stopped unexpectedly'
+        try:
+            with PROFILER.span('write save', files=len(self.plan.files)):
+                err = self.plan.run(self.signals.progress.emit)
+        except Exception as e:
+            err = f'Failed to save: {e}'
+        finally:
+            # the editor waits for finished before it saves again
+            self.signals.finished.emit(err)
+
 class RoomLI(QListWidgetItem):
-    def __init__(self, name: str):
+    def __init__(self, name: str, width: int=MIN_TILES_X, height: int=MIN_TILES_Y):
         QListWidgetItem.__init__(self)
         self.label = QLabel(name)
-        self.room = Room()
-        self.room.layout = []
-        for i in range(MIN_TILES_Y):
-            row = []
-            for j in range(MIN_TILES_X):
-                row += [None]
-            self.room.layout += [row]
+        self.room = Room(width, height)
 
         self.room.name = lambda: name
 
 class TileLI(QListWidgetItem):
-    def __init__(self, tile: Tile):
+    def __init__(self, tile: Tile, usage: int, shared: bool=False):
         QListWidgetItem.__init__(self)
         self.wid: QWidget = QWidget()
         layout = QVBoxLayout()
         self.im = QLabel()
-        self.im.setPixmap(tile.image)
+        self.im.setPixmap(IMAGE_CACHE.get(tile.image_path, THUMB_HW))
         layout.addWidget(self.im)
-        layout.addWidget(QLabel(tile.name))
+        layout.addWidget(QLabel(tile.name + (' (shared)' if shared else '')))
+        self.usage_label = QLabel()
+        self.set_usage(usage)
+        layout.addWidget(self.usage_label)
         self.wid.setLayout(layout)
         self.setSizeHint(self.wid.sizeHint())
         self.tile = tile
 
+    def set_usage(self, usage: int):
+        self.usage_label.setText(f'{usage} cells')
+
 class RoomList(QListWidget):
     def __init__(self, parent) -> None:
         super().__init__(None)
         self.parent_te = parent
 
-class TileWidget(QLabel):
-    def __init__(self, parent, tile=None) -> None:
+class RoomView(QAbstractScrollArea):
+    def __init__(self, parent: 'Creator') -> None:
         super().__init__()
-        self.selected = False
-        self.x_pos = -1
-        self.y_pos = -1
         self.parent_ = parent
-        self.tile = tile
-        self.setMinimumSize(TILE_HW, TILE_HW)
-        self.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
-        if self.tile is None: return
-        self.setPixmap(self.tile.image)
+        self.room: Room = None
+        # selection corners in cell coordinates
+        self.first_selected: tuple[int, int] = None
+        self.second_selected: tuple[int, int] = None
+        # cell size in pixels at the current zoom
+        self.hw: int = TILE_HW
+        self.atlas = TileAtlas(TILE_HW)
+        # whole room drawn at a raster zoom, valid while raster_key is (room, atlas level, tile slots)
+        self.raster: QImage = None
+        self.raster_key: tuple = None
 
-    def mousePressEvent(self, ev: QMouseEvent) -> None:
-        self.parent_.set_focus(self)
-        return super().mousePressEvent(ev)
+        self.setMinimumSize(600, 300)
 
-    def set_selected(self, value: bool):
-        self.selected = value
-        self.update()
+    def set_room(self, room: Room):
+        if self.room is not None:
+            self.room.listeners.remove(self.room_changed)
+        self.room = room
+        self.raster = None
+        self.raster_key = None
+        if room is not None:
+            room.listeners += [self.room_changed]
+        self.first_selected = None
+        self.second_selected = None
+        self.horizontalScrollBar().setValue(0)
+        self.verticalScrollBar().setValue(0)
+        self.update_scroll_bars()
+        self.viewport().update()
+
+    def room_size(self) -> tuple[int, int]:
+        if self.room is None:
+            return 0, 0
+        return self.room.width(), self.room.height()
+
+    def update_scroll_bars(self):
+        width, height = self.room_size()
+        size = self.viewport().size()
+        h = self.horizontalScrollBar()
+        h.setRange(0, max(0, width * self.hw - size.width()))
+        h.setPageStep(size.width())
+        h.setSingleStep(max(self.hw, 8))
+        v = self.verticalScrollBar()
+        v.setRange(0, max(0, height * self.hw - size.height()))
+        v.setPageStep(size.height())
+        v.setSingleStep(max(self.hw, 8))
+
+    def zoom(self, steps: int, anchor: QPoint=None):
+        '''Zooms in by steps of ZOOM_HWS, out for negative steps, keeping the point under anchor in place.'''
+        i = ZOOM_HWS.index(self.hw)
+        hw = ZOOM_HWS[max(0, min(len(ZOOM_HWS) - 1, i + steps))]
+        self.set_zoom(hw, anchor)
+
+    def set_zoom(self, hw: int, anchor: QPoint=None):
+        if hw == self.hw: return
+        if anchor is None:
+            anchor = self.viewport().rect().center()
+        h = self.horizontalScrollBar()
+        v = self.verticalScrollBar()
+        x = (h.value() + anchor.x()) / self.hw
+        y = (v.value() + anchor.y()) / self.hw
+        self.hw = hw
+        self.update_scroll_bars()
+        h.setValue(round(x * hw - anchor.x()))
+        v.setValue(round(y * hw - anchor.y()))
+        self.viewport().update()
+        self.parent_.statusBar().showMessage(f'Zoom {hw * 100 // TILE_HW}%')
+
+    def cell_at(self, pos: QPoint) -> tuple[int, int]:
+        x = (pos.x() + self.horizontalScrollBar().value()) // self.hw
+        y = (pos.y() + self.verticalScrollBar().value()) // self.hw
+        width, height = self.room_size()
+        if x < 0 or y < 0 or x >= width or y >= height:
+            return None
+        return x, y
+
+    def visible_cells(self, area: QRect=None) -> tuple[int, int, int, int]:
+        '''Cell range covering area of the viewport, the whole viewport by default.'''
+        if area is None:
+            area = self.viewport().rect()
+        width, height = self.room_size()
+        ox = self.horizontalScrollBar().value()
+        oy = self.verticalScrollBar().value()
+        x1 = max(0, (ox + area.left()) // self.hw)
+        y1 = max(0, (oy + area.top()) // self.hw)
+        x2 = min(width, (ox + area.right()) // self.hw + 1)
+        y2 = min(height, (oy + area.bottom()) // self.hw + 1)
+        return x1, y1, x2, y2
+
+    def get_selection(self) -> tuple[int, int, int, int]:
+        if self.first_selected is None: return None
+        x1, y1 = self.first_selected
+        x2, y2 = x1, y1
+        if self.second_selected is not None:
+            x2, y2 = self.second_selected
+        return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+    def get_selected_rect(self) -> Rect:
+        s = self.get_selection()
+        if s is None: return None
+        return Rect.from_points(*s)
+
+    def select(self, first: tuple[int, int], second: tuple[int, int]=None):
+        self.first_selected = first
+        self.second_selected = second
+        self.viewport().update()
+
+    def update_region(self, rect: Rect):
+        if rect is None: return
+        self.viewport().update(self.cell_rect(rect))
+
+    def update_cells(self, cells: list[tuple[int, int]]):
+        '''Schedules a repaint of cells, horizontal runs of cells are merged into one rect.'''
+        region = QRegion()
+        run = None
+        for x, y in sorted(cells, key=lambda c: (c[1], c[0])):
+            if run is not None and run.y == y and run.x + run.width == x:
+                run.width += 1
+                continue
+            if run is not None:
+                region += self.cell_rect(run)
+            run = Rect(x, y, 1, 1)
+        if run is not None:
+            region += self.cell_rect(run)
+        self.viewport().update(region)
+
+    def update_tile(self, tile: Tile):
+        '''Schedules a repaint of the visible cells holding tile, after its image changed.'''
+        if self.room is None: return
+        x1, y1, x2, y2 = self.visible_cells()
+        if x1 >= x2 or y1 >= y2: return
+        visible = Rect(x1, y1, x2 - x1, y2 - y1)
+        cells = self.room.cells_of(tile, visible)
+        if len(cells) > MAX_UPDATE_CELLS:
+            self.update_region(visible)
+        else:
+            self.update_cells(cells)
+
+    def cell_rect(self, rect: Rect) -> QRect:
+        hw = self.hw
+        return QRect(rect.x * hw - self.horizontalScrollBar().value(), rect.y * hw - self.verticalScrollBar().value(), rect.width * hw + 1, rect.height * hw + 1)
+
+    def tile_slots(self) -> list[int]:
+        return [self.atlas.add(tile.image_path) for tile in self.room.tileset]
+
+    def update_raster(self, rect: Rect):
+        '''Redraws rect of the kept raster, or drops it when the tiles changed since it was drawn.'''
+        if self.raster is None or rect is None: return
+        room, level, slots = self.raster_key
+        if room is not self.room or tuple(self.tile_slots()) != slots:
+            self.raster = None
+            self.raster_key = None
+            return
+        self.atlas.build()
+        c = self.atlas.cell >> level
+        patch = self.atlas.raster(room.grid, list(slots), level, rect.x, rect.y, rect.x + rect.width, rect.y + rect.height)
+        painter = QPainter(self.raster)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.drawImage(rect.x * c, rect.y * c, patch)
+        painter.end()
+
+    def room_changed(self, room: Room, rect: Rect, diff: Diff):
+        '''Room listener, Qt merges the updates of one event into a single paint pass.'''
+        self.update_raster(rect)
+        if len(diff) > MAX_UPDATE_CELLS:
+            self.update_region(rect)
+        else:
+            width = room.width()
+            self.update_cells([(i % width, i // width) for i in diff.indices])
 
-    def paintEvent(self, e):
-        super().paintEvent(e)
-        hw = TILE_HW
-        painter = QPainter(self)
-        # brush = QBrush(self.color)
-        # painter.setBrush(brush)        
-        # painter.drawRect(0, 0, hw, hw)
-        s = 0
-
-        pen = QPen(BASE_COLOR)
-        painter.setPen(pen)
-        painter.drawRect(s, s, hw - s*2, hw - s*2)
-        if self.selected:
-            ss = 1
-            pen = QPen(SELECTED_COLOR)
-            painter.setPen(pen)
-            painter.drawRect(ss, ss, hw - ss*2, hw - ss*2)
-        # if self.highlighted:
-        #     brush.setColor(TILE_HIGHLIGHT_COLOR)
-        #     brush.setStyle(Qt.BrushStyle.DiagCrossPattern)
-        #     painter.setBrush(brush)
-        #     painter.drawRect(2, 2, hw-4, hw-4)
-        # painter.drawPoint(hw // 2, hw // 2)
-
-    def sizeHint(self) -> QSize:
-        return QSize(TILE_HW, TILE_HW)
-
-    def set_size(hw):
-        global TILE_HW
-
-class TilesLayout(QScrollArea):
-    def __init__(self, parent: 'Creator') -> None:
-        super().__init__()
-        self.x_count = MIN_TILES_X
-        self.y_count = MIN_TILES_Y
-        self.parent_ = parent
+    # events
+    def resizeEvent(self, e: QResizeEvent) -> None:
+        super().resizeEvent(e)
+        self.update_scroll_bars()
 
-        wid = QWidget()
-        self.tiles_layout = QGridLayout()
-        self.tiles_layout.setSpacing(0)
-        # p = QPixmap('error.png')
-        # s = p.size()
-        # TileWidget.set_size(s.width())
-        # work on adding tiles
-        for i in range(self.y_count):
-            for j in range(self.x_count):
-                l = TileWidget(self.parent_)
-                l.y_pos = j
-                l.x_pos = i
-                # l.setPixmap(p)
-                self.tiles_layout.addWidget(l, i, j)
-        wid.setLayout(self.tiles_layout)
-        self.setWidgetResizable(True)
-        self.setMinimumSize(600, 300)
-        self.setWidget(wid)
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        self.viewport().update()
+
+    def wheelEvent(self, e: QWheelEvent) -> None:
+        if e.modifiers() != Qt.ControlModifier:
+            super().wheelEvent(e)
+            return
+        if e.angleDelta().y() != 0:
+            self.zoom(1 if e.angleDelta().y() > 0 else -1, e.pos())
+
+    def mousePressEvent(self, e: QMouseEvent) -> None:
+        cell = self.cell_at(e.pos())
+        if cell is None: return
+        if e.modifiers() == Qt.ShiftModifier and self.first_selected is not None:
+            self.select(self.first_selected, cell)
+        else:
+            self.select(cell)
+        self.parent_.setFocus()
+
+    def paintEvent(self, e: QPaintEvent) -> None:
+        if self.room is None: return
+        painter = QPainter(self.viewport())
+        ox = self.horizontalScrollBar().value()
+        oy = self.verticalScrollBar().value()
+        hw = self.hw
+        x1, y1, x2, y2 = self.visible_cells(e.rect())
+        if x1 >= x2 or y1 >= y2: return
+        slots = self.tile_slots()
+        self.atlas.build()
+        level = self.atlas.level_for(hw)
+        with PROFILER.span('paint room', cells=(x2 - x1) * (y2 - y1), hw=hw):
+            target = QRect(x1 * hw - ox, y1 * hw - oy, (x2 - x1) * hw, (y2 - y1) * hw)
+            width, height = self.room_size()
+            if hw <= RASTER_MAX_HW and width * height * hw * hw * 4 <= RASTER_BYTES:
+                key = (self.room, level, tuple(slots))
+                if self.raster_key != key:
+                    with PROFILER.span('build room raster'):
+                        self.raster = self.atlas.raster(self.room.grid, slots, level, 0, 0, width, height)
+                    self.raster_key = key
+                painter.drawImage(target, self.raster, QRect(x1 * hw, y1 * hw, (x2 - x1) * hw, (y2 - y1) * hw))
+            elif hw <= RASTER_MAX_HW:
+                painter.drawImage(target, self.atlas.raster(self.room.grid, slots, level, x1, y1, x2, y2))
+            else:
+                pixmap = self.atlas.pixmaps[level]
+                sources = [None] + [self.atlas.source(slot, level) if slot >= 0 else None for slot in slots]
+                painter.setPen(QPen(BASE_COLOR))
+                grid = hw >= GRID_MIN_HW
+                for y in range(y1, y2):
+                    py = y * hw - oy
+                    px = x1 * hw - ox
+                    for code in self.room.grid.row(y, x1, x2):
+                        source = sources[code]
+                        if source is not None:
+                            painter.drawPixmap(QRect(px, py, hw, hw), pixmap, source)
+                        if grid:
+                            painter.drawRect(px, py, hw, hw)
+                        px += hw
+        s = self.get_selection()
+        if s is None: return
+        sx1, sy1, sx2, sy2 = s
+        inset = 1 if hw >= GRID_MIN_HW else 0
+        painter.setPen(QPen(SELECTED_COLOR))
+        painter.drawRect(sx1 * hw - ox + inset, sy1 * hw - oy + inset, (sx2 - sx1 + 1) * hw - 2 * inset, (sy2 - sy1 + 1) * hw - 2 * inset)
     
 class TileEditor(QDialog):
     def __init__(self, parent) -> None:
@@ -205,8 +472,13 @@ class TileEditor(QDialog):
 
         self.last = None
 
-        self.script_editor = ScriptEditor(self)
+        # built the first time the script is edited
+        self.script_editor: ScriptEditor = None
         self.script_result: str = ''
+        self.analyzer = ScriptAnalyzer(self.analyzed)
+        # key of script_result and the functions to select once it is analyzed
+        self.script_key: str = None
+        self.wanted_funcs: tuple[str, str] = ('', '')
 
     def initUI(self):
         mainLayout = QVBoxLayout()
@@ -249,7 +521,7 @@ class TileEditor(QDialog):
         imagePath = fname[0]
         if imagePath == '': return
         self.image_path = imagePath
-        self.image = QPixmap(imagePath)
+        self.image = IMAGE_CACHE.get(imagePath, TILE_HW)
         self.image_button.setText('')
         self.image_button.setIcon(QIcon(self.image))
         self.image_button.setIconSize(self.image.rect().size())
@@ -262,27 +534,30 @@ class TileEditor(QDialog):
         self.display_name_field.setText(tile.display_name)
         self.passable_field.setChecked(tile.passable)
         self.seethrough_field.setChecked(tile.seethrough)
-        self.script_editor.load(tile.script)
         self.script_result = tile.script
-        self.add_funcs()
-        self.step_script_box.setCurrentText(tile.step_func)
-        self.interact_script_box.setCurrentText(tile.interact_func)
+        self.add_funcs(tile.step_func, tile.interact_func)
         self.last = tile
 
-    def add_funcs(self):
-        f_names = ['']
-        sls = self.step_script_box.currentText()
-        ils = self.interact_script_box.currentText()
+    def add_funcs(self, sls: str, ils: str):
+        '''Fills the function boxes from the analysis of script_result, which may arrive later.'''
+        self.wanted_funcs = (sls, ils)
+        # keep the current choices until the script is analyzed so packing the tile doesn't lose them
+        self.set_funcs(list(dict.fromkeys(['', sls, ils])))
+        self.script_key = script_key(self.script_result)
+        self.analyzer.request(self.script_result)
+
+    def analyzed(self, key: str, info: ScriptInfo):
+        if key != self.script_key: return
+        self.set_funcs([''] + info.functions)
+
+    def set_funcs(self, f_names: list[str]):
+        sls, ils = self.wanted_funcs
         self.step_script_box.clear()
         self.interact_script_box.clear()
-        tree = ast.parse(self.script_result)
-        for node in ast.walk(tree):
-            if isinstance(node, astnodes.Function):
-                f_names += [node.name.id]
         self.step_script_box.addItems(f_names)
         if sls in f_names:
             self.step_script_box.setCurrentText(sls)
-        self.interact_script_box.addItems(f_names)        
+        self.interact_script_box.addItems(f_names)
         if ils in f_names:
             self.interact_script_box.setCurrentText(ils)
 
@@ -298,7 +573,7 @@ class TileEditor(QDialog):
         self.interact_script_box.clear()
         self.image_path = None
         self.image = None
-        self.script_editor.unload()
+        self.script_result = ''
         self.name_field.setFocus()
         self.saved = False
         self.last = None
@@ -309,7 +584,6 @@ class TileEditor(QDialog):
         result.display_name = self.display_name_field.text()
         result.passable = self.passable_field.isChecked()
         result.seethrough = self.seethrough_field.isChecked()
-        result.image = self.image
         result.image_path = self.image_path
         result.script = self.script_result
         result.step_func = self.step_script_box.currentText()
@@ -350,11 +624,18 @@ class TileEditor(QDialog):
         self.saved = False
         self.close()
 
+    def get_script_editor(self) -> ScriptEditor:
+        if self.script_editor is None:
+            self.script_editor = ScriptEditor(self)
+        return self.script_editor
+
     def edit_script_action(self):
-        self.script_editor.exec_()
-        if not self.script_editor.saved: return
-        self.script_result = self.script_editor.get_result()
-        self.add_funcs()
+        script_editor = self.get_script_editor()
+        script_editor.load(self.script_result)
+        script_editor.exec_()
+        if not script_editor.saved: return
+        self.script_result = script_editor.get_result()
+        self.add_funcs(self.step_script_box.currentText(), self.interact_script_box.currentText())
 
 class Creator(QMainWindow):
     def __init__(self):
@@ -364,10 +645,15 @@ class Creator(QMainWindow):
         self.saved = True
         self.watch_changes_list: list[QLineEdit|QTextEdit] = []
         self.current_room: RoomLI = None
-        self.tile_editor = TileEditor(self)
-
-        self.first_selected_tile = None
-        self.second_selected_tile = None
+        # built the first time a tile is edited
+        self.tile_editor: TileEditor = None
+        self.clip: Clip = None
+        self.save_task: SaveTask = None
+        # incremented on every edit, tells whether the project changed while a save was running
+        self.edit_count = 0
+        self.history = History()
+        # nanoseconds from STARTED_NS to the first paint of the window
+        self.startup_ns: int = None
 
         self.initUI()
 
@@ -412,6 +698,61 @@ class Creator(QMainWindow):
         self.menu_new_tile_action.setStatusTip('Create new tile')
         self.menu_new_tile_action.triggered.connect(self.new_tile_action)
 
+        self.menu_share_tile_action = QAction('&Share tile', self)
+        self.menu_share_tile_action.setStatusTip('Add the selected tile to the project tileset')
+        self.menu_share_tile_action.triggered.connect(self.share_tile_action)
+
+        self.menu_add_shared_tile_action = QAction('&Add shared tile', self)
+        self.menu_add_shared_tile_action.setStatusTip('Add a tile of the project tileset to the room')
+        self.menu_add_shared_tile_action.triggered.connect(self.add_shared_tile_action)
+
+        self.menu_override_tile_action = QAction('&Override shared tile', self)
+        self.menu_override_tile_action.setStatusTip('Replace the selected shared tile with a copy only this room uses')
+        self.menu_override_tile_action.triggered.connect(self.override_tile_action)
+
+        self.menu_undo_action = QAction('&Undo', self)
+        self.menu_undo_action.setShortcut('Ctrl+Z')
+        self.menu_undo_action.setStatusTip('Undo the last edit')
+        self.menu_undo_action.triggered.connect(self.undo_action)
+
+        self.menu_redo_action = QAction('&Redo', self)
+        self.menu_redo_action.setShortcut('Ctrl+Y')
+        self.menu_redo_action.setStatusTip('Redo the last undone edit')
+        self.menu_redo_action.triggered.connect(self.redo_action)
+
+        self.menu_zoom_in_action = QAction('Zoom &in', self)
+        self.menu_zoom_in_action.setShortcut('Ctrl+=')
+        self.menu_zoom_in_action.setStatusTip('Make the room cells larger')
+        self.menu_zoom_in_action.triggered.connect(lambda: self.room_view.zoom(1))
+
+        self.menu_zoom_out_action = QAction('Zoom &out', self)
+        self.menu_zoom_out_action.setShortcut('Ctrl+-')
+        self.menu_zoom_out_action.setStatusTip('Make the room cells smaller')
+        self.menu_zoom_out_action.triggered.connect(lambda: self.room_view.zoom(-1))
+
+        self.menu_zoom_reset_action = QAction('&Actual size', self)
+        self.menu_zoom_reset_action.setShortcut('Ctrl+0')
+        self.menu_zoom_reset_action.setStatusTip('Show room cells at their actual size')
+        self.menu_zoom_reset_action.triggered.connect(lambda: self.room_view.set_zoom(TILE_HW))
+
+        self.menu_profile_action = QAction('&Record', self)
+        self.menu_profile_action.setCheckable(True)
+        self.menu_profile_action.setChecked(PROFILER.enabled)
+        self.menu_profile_action.setStatusTip('Time loading, saving and drawing')
+        self.menu_profile_action.toggled.connect(self.profile_action)
+
+        self.menu_profile_summary_action = QAction('&Print summary', self)
+        self.menu_profile_summary_action.setStatusTip('Print the time spent in every recorded span')
+        self.menu_profile_summary_action.triggered.connect(self.profile_summary_action)
+
+        self.menu_profile_export_action = QAction('&Export trace', self)
+        self.menu_profile_export_action.setStatusTip('Save the recorded spans as a Chrome trace')
+        self.menu_profile_export_action.triggered.connect(self.profile_export_action)
+
+        self.menu_profile_clear_action = QAction('&Clear', self)
+        self.menu_profile_clear_action.setStatusTip('Discard the recorded spans')
+        self.menu_profile_clear_action.triggered.connect(PROFILER.clear)
+
         menu_bar = self.menuBar()
         self.file_menu = menu_bar.addMenu('&File')
         self.file_menu.addAction(self.menu_new_action)
@@ -422,10 +763,28 @@ class Creator(QMainWindow):
         self.file_menu.addSeparator()
         self.file_menu.addAction(self.menu_quit_action)
 
+        self.edit_menu = menu_bar.addMenu('&Edit')
+        self.edit_menu.addAction(self.menu_undo_action)
+        self.edit_menu.addAction(self.menu_redo_action)
+
         self.room_menu = menu_bar.addMenu('&Rooms')
         self.room_menu.addAction(self.menu_new_room_action)
         self.file_menu.addSeparator()
         self.room_menu.addAction(self.menu_new_tile_action)
+        self.room_menu.addAction(self.menu_share_tile_action)
+        self.room_menu.addAction(self.menu_add_shared_tile_action)
+        self.room_menu.addAction(self.menu_override_tile_action)
+
+        self.view_menu = menu_bar.addMenu('&View')
+        self.view_menu.addAction(self.menu_zoom_in_action)
+        self.view_menu.addAction(self.menu_zoom_out_action)
+        self.view_menu.addAction(self.menu_zoom_reset_action)
+
+        self.profile_menu = menu_bar.addMenu('&Profile')
+        self.profile_menu.addAction(self.menu_profile_action)
+        self.profile_menu.addAction(self.menu_profile_summary_action)
+        self.profile_menu.addAction(self.menu_profile_export_action)
+        self.profile_menu.addAction(self.menu_profile_clear_action)
 
         # game info editing
         self.game_info_layout = QFormLayout()
@@ -446,6 +805,10 @@ class Creator(QMainWindow):
         self.spawn_y_edit.setValidator(QIntValidator())
         self.watch_changes_list += [self.spawn_y_edit]
         self.game_info_layout.addRow(QLabel('Starting Y location: '), self.spawn_y_edit)
+        self.layout_encoding_box = QComboBox()
+        self.layout_encoding_box.addItems(LAYOUT_ENCODINGS)
+        self.layout_encoding_box.activated.connect(self.invalidate_saved)
+        self.game_info_layout.addRow(QLabel('Room layout encoding: '), self.layout_encoding_box)
         self.game_info_layout.addWidget(QLabel('Description'))
         self.game_description_edit = QTextEdit()
         self.watch_changes_list += [self.game_description_edit]
@@ -494,7 +857,7 @@ class Creator(QMainWindow):
 
         tiles_grid = QGridLayout()
 
-        self.tiles_layout = TilesLayout(self)
+        self.room_view = RoomView(self)
         class VertButton(QPushButton):
             def __init__(self, text: str):
                 QPushButton.__init__(self, text)
@@ -520,7 +883,7 @@ class Creator(QMainWindow):
         tiles_grid.addWidget(QPushButton('+'), 1, 2)
         tiles_grid.addWidget(QPushButton('+'), 3, 2)
         tiles_grid.addWidget(QPushButton('-'), 4, 2)
-        tiles_grid.addWidget(self.tiles_layout, 2, 2)
+        tiles_grid.addWidget(self.room_view, 2, 2)
 
         r_layout.addWidget(self.tiles_list)
         # r_layout.addWidget(scroll)
@@ -576,52 +939,23 @@ class Creator(QMainWindow):
         self.new_room_button.setEnabled(v)
         self.delete_room_button.setEnabled(v)
         self.game_rooms_list.setEnabled(v)
+        self.layout_encoding_box.setEnabled(v)
         self.tabs.setEnabled(v)
 
-    def get_selected_tiles(self) -> list[TileWidget]:
-        result = []
-        if self.first_selected_tile is None: return result
-        x1 = self.first_selected_tile.x_pos
-        y1 = self.first_selected_tile.y_pos
-        x2 = x1
-        y2 = y1
-        if self.second_selected_tile is not None:
-            x2 = self.second_selected_tile.x_pos
-            y2 = self.second_selected_tile.y_pos
-        if x1 > x2:
-            t = x1
-            x1 = x2
-            x2 = t
-        if y1 > y2:
-            t = y1
-            y1 = y2
-            y2 = t
-        for i in range(y1, y2 + 1):
-            for j in range(x1, x2 + 1):
-                result += [self.tiles_layout.tiles_layout.itemAtPosition(i, j).widget()]
-        return result
-
-    def set_selected_tiles(self, value: bool):
-        tiles = self.get_selected_tiles()
-        for t in tiles:
-            t.set_selected(value)
-
-    def unselect_tiles(self):
-        self.set_selected_tiles(False)
+    def get_tile_editor(self) -> TileEditor:
+        if self.tile_editor is None:
+            self.tile_editor = TileEditor(self)
+        return self.tile_editor
 
-    def select_tiles(self):
-        self.set_selected_tiles(True)
+    def get_selected_list_tile(self) -> Tile:
+        items = self.tiles_list.selectedItems()
+        if len(items) != 1: return None
+        return items[0].tile
 
-    def set_focus(self, t: TileWidget):
-        self.unselect_tiles()
-        tt = self.tiles_layout.tiles_layout.itemAtPosition(t.y_pos, t.x_pos).widget()
-        modifiers = QApplication.keyboardModifiers()
-        if modifiers == Qt.ShiftModifier:
-            self.second_selected_tile = tt
-        else:
-            self.second_selected_tile = None
-            self.first_selected_tile = tt
-        self.select_tiles()
+    def apply_edit(self, rect: Rect):
+        '''The room view repaints the edited cells by itself.'''
+        if rect is None: return
+        self.invalidate_saved()
 
     def can_add_tile(self, tile_name):
         for t in self.current_room.room.tileset:
@@ -634,15 +968,87 @@ class Creator(QMainWindow):
         for r in self.game.rooms:
             self.game_rooms_list.addItem(r.name())
 
+    def add_room_item(self, room: Room) -> RoomLI:
+        r = RoomLI(room.name())
+        r.room = room
+        self.rooms_listw.addItem(r)
+        self.rooms_listw.setItemWidget(r, r.label)
+        return r
+
+    def update_room_items(self):
+        '''Rebuilds the rooms sidebar after rooms were added or removed by undo or redo.
+
+        Rooms keep the listeners they got when they were loaded or created.'''
+        self.rooms_listw.clear()
+        current = None
+        for room in self.game.rooms:
+            r = self.add_room_item(room)
+            if self.current_room is not None and self.current_room.room is room:
+                current = r
+        self.current_room = current
+        if current is None:
+            self.tiles_list.clear()
+            self.room_view.set_room(None)
+        self.update_rooms_list()
+        if self.game.spawn_room is not None:
+            self.game_rooms_list.setCurrentText(self.game.spawn_room.name())
+
+    def room_changed(self, room: Room, rect: Rect, diff: Diff):
+        '''Room listener, updates the usage counts of the tiles the edit touched.'''
+        if self.current_room is None or self.current_room.room is not room: return
+        for code in set(diff.before) | set(diff.after):
+            item = self.tiles_list.item(code - 1)
+            if item is not None:
+                item.set_usage(room.usage(item.tile))
+
+    def spawn_state(self) -> tuple[Room, str, str]:
+        return self.game.spawn_room, self.spawn_x_edit.text(), self.spawn_y_edit.text()
+
+    def set_spawn(self, spawn: tuple[Room, str, str]):
+        room, x, y = spawn
+        self.game.spawn_room = room
+        self.spawn_x_edit.setText(x)
+        self.spawn_y_edit.setText(y)
+        if room is not None:
+            self.game_rooms_list.setCurrentText(room.name())
+
     def save(self):
-        err = self.game.save(self.last_save_path)
-        if err is None:
-            self.validate_saved()
+        if self.save_task is not None:
+            self.statusBar().showMessage('Save already in progress')
             return
-        print(err)
+        with PROFILER.span('plan save'):
+            plan = self.game.plan_save(self.last_save_path)
+        if isinstance(plan, str):
+            print(plan)
+            return
+        task = SaveTask(plan)
+        edit_count = self.edit_count
+        task.signals.progress.connect(self.save_progress)
+        task.signals.finished.connect(lambda err: self.save_finished(plan, err, edit_count))
+        self.save_task = task
+        QThreadPool.globalInstance().start(task)
+
+    def save_progress(self, done: int, total: int):
+        self.setWindowTitle(f'{self.game.project_name()}* (saving {done}/{total})')
+        self.statusBar().showMessage(f'Saving... {done}/{total}')
+
+    def save_finished(self, plan: SavePlan, err: None|str, edit_count: int):
+        self.save_task = None
+        plan.finish(err)
+        if err is not None:
+            self.setWindowTitle(self.game.project_name() + '*')
+            self.statusBar().showMessage('Save failed')
+            print(err)
+            return
+        if edit_count == self.edit_count:
+            self.validate_saved()
+        else:
+            self.setWindowTitle(self.game.project_name() + '*')
+        self.statusBar().showMessage(f'Saved, {len(self.game.last_written)} files written')
 
     def invalidate_saved(self):
         self.saved = False
+        self.edit_count += 1
         self.setWindowTitle(self.game.project_name() + '*')
 
     def validate_saved(self):
@@ -653,7 +1059,7 @@ class Creator(QMainWindow):
         return QMessageBox.question(self, title, message, QMessageBox.Yes|QMessageBox.No, QMessageBox.No) == QMessageBox.Yes
 
     def add_tile_to_list(self, tile: Tile):
-        item = TileLI(tile)
+        item = TileLI(tile, self.current_room.room.usage(tile), tile in self.game.tileset)
         # item = QListWidgetItem()
         self.tiles_list.addItem(item)
         self.tiles_list.setItemWidget(item, item.wid)
@@ -678,26 +1084,27 @@ class Creator(QMainWindow):
         self.spawn_y_edit.setText(str(game.spawn_temp_y_loc))
         del game.spawn_temp_y_loc
 
-        # rooms
-        for room in self.game.rooms:
-            self.r_widget.setEnabled(True)
-            n = room.temp_name
-            del room.temp_name
-            r = RoomLI(n)
-            room.name = lambda: n
-            r.room = room
-            self.rooms_listw.addItem(r)
-            self.rooms_listw.setItemWidget(r, r.label)
-
-            for tile in room.tileset:
-                tile.image = QPixmap(tile.image_path)
+        self.layout_encoding_box.setCurrentText(game.temp_layout_encoding)
+        del game.temp_layout_encoding
 
-        self.update_rooms_list()
+        # rooms
+        self.history.clear()
+        with PROFILER.span('build room list'):
+            for room in self.game.rooms:
+                self.r_widget.setEnabled(True)
+                n = room.temp_name
+                del room.temp_name
+                room.name = lambda n=n: n
+                room.listeners += [self.history.room_changed, self.room_changed]
+                self.add_room_item(room)
+
+            self.update_rooms_list()
 
         # self.update_room_panel()
         self.game_rooms_list.setCurrentText(self.game.spawn_room.name())
 
         self.set_enabled_game_specific(True)
+        self.statusBar().showMessage(f'Images: {IMAGE_CACHE.stats()}')
 
     def bind_values(self):
         self.game.project_name = self.game_project_name_edit.text
@@ -705,6 +1112,7 @@ class Creator(QMainWindow):
         self.game.description = self.game_description_edit.toPlainText
         self.game.spawn_x_loc = lambda: int(self.spawn_x_edit.text() if self.spawn_x_edit.text() else -1)
         self.game.spawn_y_loc = lambda: int(self.spawn_y_edit.text() if self.spawn_x_edit.text() else -1)
+        self.game.layout_encoding = self.layout_encoding_box.currentText
 
     # actions
     def new_action(self):
@@ -712,7 +1120,9 @@ class Creator(QMainWindow):
             return
             
         self.game = Game()
+        self.room_view.atlas.clear()
         self.bind_values()
+        self.history.clear()
         self.set_enabled_game_specific(True)
 
         self.game_project_name_edit.setText('Project1')
@@ -723,8 +1133,10 @@ class Creator(QMainWindow):
     def load_action(self):
         dir = QFileDialog.getExistingDirectory(self, "Select Directory")
         # try:
-        self.game = Game.load(dir)
-        self.load_from_game()
+        self.game = Game.load(dir, lazy=True)
+        self.room_view.atlas.clear()
+        with PROFILER.span('load from game', rooms=len(self.game.rooms)):
+            self.load_from_game()
         # except Exception as e:
         #     QMessageBox.critical(self, 'Loading project', f'Failed to load project:\n\n{str(e)}')
 
@@ -752,8 +1164,16 @@ class Creator(QMainWindow):
         if self.game.exists_room_with_name(r_name):
             # TODO show error
             return
-        room_li = RoomLI(r_name)
+        width, entered = QInputDialog.getInt(self, 'New room', 'Width in tiles', MIN_TILES_X, 1, 65535)
+        if not entered: return
+        height, entered = QInputDialog.getInt(self, 'New room', 'Height in tiles', MIN_TILES_Y, 1, 65535)
+        if not entered: return
+        room_li = RoomLI(r_name, width, height)
         room = room_li.room
+        room.shared_tiles = self.game.tileset
+        room.defs = self.game.defs
+        room.listeners += [self.history.room_changed, self.room_changed]
+        spawn_before = self.game.spawn_room
         self.game.rooms += [room]
         self.rooms_listw.addItem(room_li)
         self.rooms_listw.setItemWidget(room_li, room_li.label)
@@ -762,8 +1182,10 @@ class Creator(QMainWindow):
         self.current_room = room_li
         self.r_widget.setEnabled(True)
         self.update_room_panel()
+        self.room_view.set_room(room)
         if self.game.spawn_room is None:
             self.chosen_spawn_room_action()
+        self.history.push(RoomAdd(self.game, room, spawn_before))
 
     def update_room_panel(self):
         self.tiles_list.clear()
@@ -772,19 +1194,12 @@ class Creator(QMainWindow):
             self.add_tile_to_list(tile)
 
     def room_clicked_action(self, item):
-        self.current_room = item
-        self.update_room_panel()
-        
-        layout = self.tiles_layout.widget().layout()
-        while layout.count() > 0: 
-            layout.itemAt(0).widget().setParent(None)
-        room = item.room
-        for i in range(len(room.layout)):
-            for j in range(len(room.layout[0])):
-                w = TileWidget(self, room.layout[i][j])
-                layout.addWidget(w, j, i)
-                w.x_pos = j
-                w.y_pos = i
+        with PROFILER.span('open room', room=item.room.name()):
+            self.current_room = item
+            # lazily loaded rooms are read here on first access
+            with PROFILER.span('build tiles list'):
+                self.update_room_panel()
+            self.room_view.set_room(item.room)
 
     def delete_room_action(self):
         pass
@@ -795,31 +1210,108 @@ class Creator(QMainWindow):
         s: list[TileLI] = self.tiles_list.selectedItems()
         if len(s) != 1: return
         i = i[0].row()
-        self.tile_editor.load(s[0].tile)
-        self.tile_editor.exec_()
-        if not self.tile_editor.saved: return
-        tile = self.tile_editor.pack()
-        self.current_room.room.tileset[i].copy(tile)
-        tile = self.current_room.room.tileset[i]
-        layout = self.current_room.room.layout
-        for i in range(len(layout)):
-            for j in range(len(layout[0])):
-                if layout[i][j] != tile: continue
-                t: TileWidget = self.tiles_layout.tiles_layout.itemAtPosition(i, j).widget()
-                t.setPixmap(tile.image)
+        tile_editor = self.get_tile_editor()
+        tile_editor.load(s[0].tile)
+        tile_editor.exec_()
+        if not tile_editor.saved: return
+        tile = tile_editor.pack()
+        room = self.current_room.room
+        before = room.tileset[i].clone()
+        room.edit_tile(i, tile)
+        self.history.push(TileEdit(room, i, before, room.tileset[i].clone()))
+        self.room_view.update_tile(room.tileset[i])
         self.invalidate_saved()
 
     def new_tile_action(self):
         if self.game is None: return
         if self.current_room is None: return
-        self.tile_editor.unload()
-        self.tile_editor.exec_()
-        if not self.tile_editor.saved: return
-        tile = self.tile_editor.pack()
-        self.current_room.room.tileset += [tile]
+        tile_editor = self.get_tile_editor()
+        tile_editor.unload()
+        tile_editor.exec_()
+        if not tile_editor.saved: return
+        tile = tile_editor.pack()
+        self.current_room.room.add_tile(tile)
+        self.history.push(TileAdd(self.current_room.room, tile))
         self.add_tile_to_list(tile)
         self.invalidate_saved()
 
+    def share_tile_action(self):
+        if self.game is None or self.current_room is None: return
+        tile = self.get_selected_list_tile()
+        if tile is None or tile in self.game.tileset: return
+        for t in self.game.tileset:
+            if t.name == tile.name:
+                self.mb(f'The project tileset already has a tile named {tile.name}')
+                return
+        self.game.tileset.append(tile)
+        # the room file refers to the tile by index from now on
+        self.current_room.room.dirty = True
+        self.history.push(TileShare(self.game, self.current_room.room, tile))
+        self.update_room_panel()
+        self.invalidate_saved()
+
+    def add_shared_tile_action(self):
+        if self.game is None or self.current_room is None: return
+        room = self.current_room.room
+        tiles = [t for t in self.game.tileset if t not in room.codes and self.can_add_tile(t.name)]
+        if len(tiles) == 0: return
+        name, entered = QInputDialog.getItem(self, 'Add shared tile', 'Tile', [t.name for t in tiles], 0, False)
+        if not entered: return
+        tile = tiles[[t.name for t in tiles].index(name)]
+        room.add_tile(tile)
+        self.history.push(TileAdd(room, tile))
+        self.add_tile_to_list(tile)
+        self.invalidate_saved()
+
+    def override_tile_action(self):
+        if self.game is None or self.current_room is None: return
+        tile = self.get_selected_list_tile()
+        if tile is None or tile not in self.game.tileset: return
+        room = self.current_room.room
+        i = room.tileset.index(tile)
+        clone = tile.clone()
+        room.replace_tile(i, clone)
+        self.history.push(TileReplace(room, i, tile, clone))
+        self.update_room_panel()
+        self.invalidate_saved()
+
+    def undo_action(self):
+        if self.game is None: return
+        try:
+            self.history_applied(self.history.undo())
+        except ValueError as e:
+            self.mb(f'Could not undo: {e}')
+
+    def redo_action(self):
+        if self.game is None: return
+        self.history_applied(self.history.redo())
+
+    def history_applied(self, edit):
+        '''Brings the widgets up to date with an edit that was undone or redone.'''
+        if edit is None: return
+        if isinstance(edit, RoomAdd):
+            self.update_room_items()
+        elif isinstance(edit, (TileAdd, TileEdit, TileReplace, TileShare)) or isinstance(edit, CellsEdit) and len(edit.diff.tiles) > 0:
+            # pastes add the tiles of the pasted cells
+            if self.current_room is not None and self.current_room.room is edit.room:
+                self.update_room_panel()
+                if isinstance(edit, TileEdit):
+                    self.room_view.update_tile(edit.room.tileset[edit.i])
+        self.invalidate_saved()
+
+    def profile_action(self, checked: bool):
+        PROFILER.enabled = checked
+
+    def profile_summary_action(self):
+        print(PROFILER.summary())
+        self.statusBar().showMessage(f'{len(PROFILER.events)} spans recorded')
+
+    def profile_export_action(self):
+        p, _ = QFileDialog.getSaveFileName(self, 'Export trace', 'trace.json', 'Chrome trace (*.json)')
+        if p == '': return
+        PROFILER.write_trace(p)
+        self.statusBar().showMessage(f'Trace written to {p}')
+
     def chosen_spawn_room_action(self):
         room_name = self.game_rooms_list.currentText()
         for r in self.game.rooms:
@@ -828,44 +1320,79 @@ class Creator(QMainWindow):
                 return
         raise Exception('Err: can\'t set non-existing room with name "' + room_name + '" as spawn room')
 
+    def started(self):
+        '''Runs once after the first paint of the window.'''
+        seconds = self.startup_ns / 1e9
+        PROFILER.record('first window', STARTED_NS, self.startup_ns)
+        if os.environ.get(EXIT_AFTER_START_ENV):
+            print(f'startup {seconds:.4f}')
+            self.close()
+            return
+        self.statusBar().showMessage(f'Started in {seconds * 1000:.0f} ms')
+        QThreadPool.globalInstance().start(WarmUpTask())
+
     # events
+    def paintEvent(self, e: QPaintEvent) -> None:
+        super().paintEvent(e)
+        if self.startup_ns is None:
+            self.startup_ns = time.perf_counter_ns() - STARTED_NS
+            QTimer.singleShot(0, self.started)
+
     def closeEvent(self, e) -> None:
         if not self.saved and not self.yn('Closing', 'Are you sure you want to quit? Unsaved changes will be discarded.'):
             e.ignore()
             return
+        # let a running save complete before the process exits
+        QThreadPool.globalInstance().waitForDone()
+        if os.environ.get(PROFILE_ENV):
+            PROFILER.write_trace(os.environ[PROFILE_ENV])
+            print(PROFILER.summary())
         e.accept()
 
     def keyPressEvent(self, e: QKeyEvent) -> None:
         modifiers = QApplication.keyboardModifiers()
         is_room = self.tabs.currentWidget() == self.room_info_tab
-        if e.key() == Qt.Key_Space:
-            items = self.tiles_list.selectedItems()
-            if len(items) == 1:
-                item: TileLI = items[0]
-                t = item.tile
-                layout = self.current_room.room.layout
-                image = t.image
-                tiles = self.get_selected_tiles()
-                for tile in tiles:
-                    tile.setPixmap(image)
-                    layout[tile.y_pos][tile.x_pos] = t
-                self.invalidate_saved()
+        view = self.room_view
+        if e.key() == Qt.Key_Space and view.first_selected is not None:
+            tile = self.get_selected_list_tile()
+            if tile is not None:
+                self.apply_edit(self.current_room.room.fill(view.get_selected_rect(), tile))
+        if e.key() == Qt.Key_F and modifiers == Qt.NoModifier and is_room and view.first_selected is not None:
+            tile = self.get_selected_list_tile()
+            if tile is not None:
+                x, y = view.first_selected
+                self.apply_edit(self.current_room.room.flood_fill(x, y, tile))
+        if e.key() == Qt.Key_R and modifiers == Qt.NoModifier and is_room and view.first_selected is not None:
+            tile = self.get_selected_list_tile()
+            if tile is not None:
+                room = self.current_room.room
+                self.apply_edit(room.replace(room.tile_at(*view.first_selected), tile))
+        if e.key() == Qt.Key_C and modifiers == Qt.ControlModifier and is_room and view.first_selected is not None:
+            self.clip = self.current_room.room.copy_region(view.get_selected_rect())
+        if e.key() == Qt.Key_V and modifiers == Qt.ControlModifier and is_room and view.first_selected is not None:
+            if self.clip is not None:
+                room = self.current_room.room
+                tile_count = len(room.tileset)
+                self.apply_edit(room.paste(*view.first_selected, self.clip))
+                if len(room.tileset) != tile_count:
+                    self.update_room_panel()
         if e.key() == Qt.Key_A and modifiers == Qt.ControlModifier and is_room:
-            self.first_selected_tile = self.tiles_layout.tiles_layout.itemAtPosition(0, 0).widget()
-            height = self.tiles_layout.y_count
-            width = self.tiles_layout.x_count
-            self.second_selected_tile = self.tiles_layout.tiles_layout.itemAtPosition(width-1, height-1).widget()
-            self.select_tiles()
+            width, height = self.room_view.room_size()
+            if width > 0 and height > 0:
+                self.room_view.select((0, 0), (width-1, height-1))
         if e.key() == Qt.Key_S and modifiers == Qt.AltModifier and is_room:
-            if not (self.first_selected_tile is not None and self.second_selected_tile is None): return
+            if not (view.first_selected is not None and view.second_selected is None): return
             if self.current_room is None: return
-            self.game.spawn_room = self.current_room.room
-            self.spawn_x_edit.setText(str(self.first_selected_tile.x_pos))
-            self.spawn_y_edit.setText(str(self.first_selected_tile.y_pos))
+            before = self.spawn_state()
+            x, y = view.first_selected
+            self.set_spawn((self.current_room.room, str(x), str(y)))
+            self.history.push(ValueEdit(self.set_spawn, before, self.spawn_state()))
             self.mb('Spawn set')
         return super().keyPressEvent(e)
 
 if __name__ == '__main__':
+    # TILED_PROFILE=trace.json records from startup and writes the trace there on exit
+    PROFILER.enabled = bool(os.environ.get(PROFILE_ENV))
     app = QApplication(sys.argv)
     ex = Creator()
     ex.show()
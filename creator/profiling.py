@@ -0,0 +1,91 @@
+'''Opt-in timing of named spans, exported as a Chrome trace or printed as a summary table.
+
+Profiling is off unless PROFILER.enabled is set. The editor sets it from its Profile
+menu or when the TILED_PROFILE environment variable names a file to write the trace
+to on exit, cli.py sets it with --profile. While disabled span returns a shared no-op
+context manager, so spans can stay in the load, save and render paths.'''
+
+import json
+import os
+import threading
+import time
+
+PROFILE_ENV = 'TILED_PROFILE'
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+NO_SPAN = NoSpan()
+
+class Span:
+    def __init__(self, profiler: 'Profiler', name: str, args: dict) -> None:
+        self.profiler: Profiler = profiler
+        self.name: str = name
+        self.args: dict = args
+        self.start: int = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.profiler.record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+class Profiler:
+    '''Collects completed spans of every thread of the process.'''
+
+    def __init__(self) -> None:
+        self.enabled: bool = False
+        # (name, pid, tid, start ns, duration ns, args), appending to a list is atomic so threads don't need a lock
+        self.events: list[tuple[str, int, int, int, int, dict]] = []
+
+    def span(self, name: str, **args):
+        '''Context manager timing its block as a span called name, args are shown with it in the trace.'''
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, args)
+
+    def record(self, name: str, start: int, duration: int, args: dict=None):
+        self.events.append((name, os.getpid(), threading.get_native_id(), start, duration, args or {}))
+
+    def take(self) -> list[tuple[str, int, int, int, int, dict]]:
+        '''Removes and returns the recorded spans, used to send them from worker processes.'''
+        result = self.events
+        self.events = []
+        return result
+
+    def clear(self):
+        self.events = []
+
+    def trace(self) -> dict:
+        '''Recorded spans in the Chrome trace event format, for chrome://tracing or Perfetto.'''
+        origin = min((e[3] for e in self.events), default=0)
+        events = []
+        for name, pid, tid, start, duration, args in self.events:
+            events += [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': (start - origin) / 1000, 'dur': duration / 1000, 'args': args}]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, p: str):
+        with open(p, 'w') as f:
+            json.dump(self.trace(), f)
+
+    def summary(self) -> str:
+        '''Table of the count, total, mean and max time of every span name, slowest total first.'''
+        totals: dict[str, list[int]] = {}
+        for name, _, _, _, duration, _ in self.events:
+            entry = totals.setdefault(name, [0, 0, 0])
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+        width = max([len(name) for name in totals] + [len('span')])
+        lines = [f'{"span":<{width}} {"count":>7} {"total ms":>10} {"mean ms":>10} {"max ms":>10}']
+        for name, (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines += [f'{name:<{width}} {count:>7} {total / 1e6:>10.3f} {total / count / 1e6:>10.3f} {longest / 1e6:>10.3f}']
+        return '\n'.join(lines)
+
+PROFILER = Profiler()
@@ -0,0 +1,12 @@
+from PyQt5.Qsci import QsciScintilla, QsciLexerLua
+
+class ScriptWidget(QsciScintilla):
+    def __init__(self, parent) -> None:
+        super().__init__(parent)
+
+        lexer = QsciLexerLua()
+        self.setLexer(lexer)
+        self.setAutoIndent(True)
+        # self.setAutoCompletionSource()
+        
+        self.setMinimumSize(600, 450)
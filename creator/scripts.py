@@ -0,0 +1,57 @@
+import hashlib
+from collections import OrderedDict
+
+class ScriptInfo:
+    '''What the editor needs to know about a tile script: its functions or its syntax error.'''
+
+    def __init__(self, functions: list[str], error: str=None) -> None:
+        self.functions: list[str] = functions
+        self.error: str = error
+
+def script_key(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+def analyze(text: str) -> ScriptInfo:
+    '''Parses text, slow on large scripts, so the editor runs it on a pool thread.
+
+    luaparser is imported on the first call, it is slow to import and not needed to open a project.'''
+    from luaparser import ast, astnodes, builder
+    try:
+        tree = ast.parse(text)
+    except builder.SyntaxException as e:
+        return ScriptInfo([], str(e))
+    functions = []
+    for node in ast.walk(tree):
+        if isinstance(node, astnodes.Function):
+            functions += [node.name.id]
+    return ScriptInfo(functions)
+
+class ScriptCache:
+    '''LRU cache of script analysis results keyed by the hash of the script text.'''
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries: int = max_entries
+        self.entries: OrderedDict[str, ScriptInfo] = OrderedDict()
+
+    def get(self, key: str) -> ScriptInfo:
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        return result
+
+    def put(self, key: str, info: ScriptInfo):
+        self.entries[key] = info
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def analyze(self, text: str) -> ScriptInfo:
+        '''Cached analysis of text, parsed on the calling thread on a miss.'''
+        key = script_key(text)
+        result = self.get(key)
+        if result is None:
+            result = analyze(text)
+            self.put(key, result)
+        return result
+
+SCRIPT_CACHE = ScriptCache(256)
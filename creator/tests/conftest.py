@@ -0,0 +1,7 @@
+import os.path as path
+import sys
+
+# the creator modules import each other as top level modules, like they do when main.py runs
+CREATOR = path.dirname(path.dirname(path.abspath(__file__)))
+if CREATOR not in sys.path:
+    sys.path.insert(0, CREATOR)
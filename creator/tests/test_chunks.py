@@ -0,0 +1,55 @@
+from chunks import ChunkedGrid
+from grid import Grid
+
+def test_taken_chunks_stay_loaded_until_the_save_finishes():
+    # a budget of two chunks
+    grid = ChunkedGrid(256, 256, 64, budget=2 * Grid(64, 64).nbytes())
+    grid.set(1, 1, 7)
+    taken = grid.take_dirty()
+    for key in [(1, 0), (2, 0), (3, 0)]:
+        grid.chunk(key)
+    assert grid.get(1, 1) == 7
+
+    grid.save_failed(set(taken))
+    assert grid.take_dirty()[(0, 0)][1 * 64 + 1] == 7
+
+def test_saved_chunks_can_be_evicted():
+    grid = ChunkedGrid(256, 256, 64, budget=2 * Grid(64, 64).nbytes())
+    grid.set(1, 1, 7)
+    taken = grid.take_dirty()
+    grid.saved(None, set(), set(taken))
+    for key in [(1, 0), (2, 0), (3, 0)]:
+        grid.chunk(key)
+    assert (0, 0) not in grid.chunks
+
+def test_huge_rooms_are_chunked_without_allocating_a_grid():
+    from game import Room
+    room = Room(65535, 65535)
+    assert room.is_chunked()
+    assert room.grid.nbytes() == 0
+
+def test_opening_a_saved_chunked_room_counts_tiles_without_reading_chunks(tmp_path, monkeypatch):
+    import chunks
+    from bench.generate import generate
+    from game import Game, Room
+    from grid import Rect
+    project = str(tmp_path / 'project')
+    assert generate(project, 1, 16, 16, 4, 1) is None
+    game = Game.load(project, cache=False)
+    game.bind_loaded()
+    room = Room(600, 600)
+    room.name = lambda: 'huge'
+    a, b = game.rooms[0].tileset[:2]
+    room.add_tile(a)
+    room.add_tile(b)
+    room.fill(Rect(0, 0, 600, 600), a)
+    room.set_tile(5, 5, b)
+    game.rooms += [room]
+    assert game.save(project) is None
+
+    game = Game.load(project, lazy=True, cache=False)
+    huge = [r for r in game.rooms if r.temp_name == 'huge'][0]
+    monkeypatch.setattr(chunks, 'decode_chunk', None)
+    assert huge.usage(huge.tileset[1]) == 1
+    assert huge.usage(huge.tileset[0]) == 600 * 600 - 1
+    assert len(huge.grid.chunks) == 0
@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import random
+
+from bench.generate import generate
+from cache import RoomCache
+from game import Game, Room, ROOM_VERSION, decode_room, tile_codes, write_room
+from grid import Grid, Rect
+
+def room_text(tiles: int, encoding: str, seed: int=3) -> tuple[str, Grid, dict]:
+    '''Text of a 20x12 room of tiles tiles written by write_room, the grid and the header it was written from.'''
+    rng = random.Random(seed)
+    grid = Grid(20, 12)
+    # runs of equal cells so rle has something to merge
+    for y in range(grid.height):
+        x = 0
+        while x < grid.width:
+            n = rng.randrange(1, 6)
+            grid.fill(Rect(x, y, n, 1), rng.randrange(1, tiles + 1))
+            x += n
+    codes = tile_codes(tiles)
+    header = {}
+    if len(codes[0]) > 1 or encoding != 'plain':
+        header['version'] = ROOM_VERSION
+        header['code_width'] = len(codes[0])
+    if encoding != 'plain':
+        header['layout_encoding'] = encoding
+    header['tileset'] = {code: {'name': f't{i}'} for i, code in enumerate(codes)}
+    f = io.StringIO()
+    write_room(f, header, grid, [''] + codes, encoding)
+    return f.getvalue(), grid, header
+
+def check_round_trip(tiles: int, encoding: str):
+    text, grid, header = room_text(tiles, encoding)
+    tileset_j, decoded, decoded_encoding = decode_room(text, 'room.json')
+    assert decoded_encoding == encoding
+    assert (decoded.width, decoded.height) == (grid.width, grid.height)
+    assert decoded.data == grid.data
+    assert tileset_j == header['tileset']
+
+def test_plain_rooms_round_trip():
+    text, _, header = room_text(10, 'plain')
+    assert 'version' not in header
+    check_round_trip(10, 'plain')
+
+def test_rooms_with_more_tiles_than_chars_use_wider_codes():
+    text, _, header = room_text(100, 'plain')
+    assert header['code_width'] == 2
+    check_round_trip(100, 'plain')
+
+def test_rle_rooms_round_trip():
+    check_round_trip(10, 'rle')
+    check_round_trip(100, 'rle')
+
+def test_written_rooms_match_json_dumps():
+    for tiles, encoding in [(10, 'plain'), (100, 'plain'), (10, 'rle')]:
+        text, _, header = room_text(tiles, encoding)
+        layout = json.loads(text)['layout']
+        assert text == json.dumps({**header, 'layout': layout}, indent=4)
+
+def test_cache_hits_until_the_room_file_changes(tmp_path):
+    project = str(tmp_path / 'project')
+    assert generate(project, 2, 16, 16, 4, 1) is None
+    room_path = os.path.join(project, 'rooms', sorted(n for n in os.listdir(os.path.join(project, 'rooms')) if n.endswith('.json'))[0])
+    text = open(room_path, 'r', encoding='utf-8').read()
+    cache = RoomCache(project)
+    assert cache.get(room_path) is None
+    tileset_j, grid, encoding = decode_room(text, room_path)
+    cache.put(room_path, tileset_j, grid, encoding)
+
+    hit = cache.get(room_path)
+    assert hit is not None
+    assert hit[0] == tileset_j and hit[1].data == grid.data and hit[2] == encoding
+
+    # same size and a new mtime, only the hash tells whether the room changed
+    st = os.stat(room_path)
+    os.utime(room_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.get(room_path) is not None
+    # same size and different contents
+    with open(room_path, 'w', encoding='utf-8') as f:
+        f.write(text.replace('    ', '\t   ', 1))
+    assert os.stat(room_path).st_size == st.st_size
+    assert cache.get(room_path) is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_shared_tiles_load_as_one_tile(tmp_path):
+    project = str(tmp_path / 'project')
+    assert generate(project, 1, 16, 16, 4, 1) is None
+    game = Game.load(project, cache=False)
+    game.bind_loaded()
+    first = game.rooms[0]
+    wall = first.tileset[0]
+    game.tileset.append(wall)
+    first.dirty = True
+    second = Room(5, 5)
+    second.name = lambda: 'second'
+    second.shared_tiles = game.tileset
+    second.add_tile(wall)
+    second.fill(Rect(0, 0, 5, 5), wall)
+    game.rooms += [second]
+    assert game.save(project) is None
+    room_j = json.loads(open(os.path.join(project, 'rooms', 'second.json'), 'r', encoding='utf-8').read())
+    assert list(room_j['tileset'].values()) == [{'shared': 0}]
+
+    game = Game.load(project, cache=False)
+    a, b = game.rooms
+    assert a.tileset[0] is b.tileset[0] is game.tileset[0]
+    assert b.tile_at(4, 4) is game.tileset[0]
@@ -0,0 +1,106 @@
+from game import Room, Tile
+from grid import Rect
+from history import History, TileAdd
+
+def named_tile(name: str) -> Tile:
+    tile = Tile()
+    tile.name = name
+    return tile
+
+def test_undoing_a_paste_removes_the_tiles_it_added():
+    source = Room(4, 4)
+    u = named_tile('u')
+    source.add_tile(u)
+    source.set_tile(0, 0, u)
+    clip = source.copy_region(Rect(0, 0, 2, 2))
+
+    room = Room(4, 4)
+    history = History()
+    room.listeners.append(history.room_changed)
+    t = named_tile('t')
+    room.add_tile(t)
+    history.push(TileAdd(room, t))
+    room.paste(1, 1, clip)
+    u = room.tile_at(1, 1)
+    assert room.tileset == [t, u]
+
+    history.undo()
+    assert room.tileset == [t]
+    assert room.tile_at(1, 1) is None
+    history.undo()
+    assert room.tileset == []
+
+    history.redo()
+    history.redo()
+    assert room.tileset == [t, u]
+    assert room.tile_at(1, 1) is u
+
+def test_pasted_tiles_of_other_rooms_are_cloned_and_renamed():
+    source = Room(4, 4)
+    shared = named_tile('shared')
+    source.shared_tiles = [shared]
+    room = Room(4, 4)
+    room.shared_tiles = [shared]
+    u = named_tile('u')
+    taken = named_tile('u')
+    taken.display_name = 'other'
+    for tile in [shared, u]:
+        source.add_tile(tile)
+    source.set_tile(0, 0, shared)
+    source.set_tile(1, 0, u)
+    room.add_tile(taken)
+    clip = source.copy_region(Rect(0, 0, 2, 1))
+
+    room.paste(0, 0, clip)
+    pasted = room.tile_at(1, 0)
+    assert room.tile_at(0, 0) is shared
+    assert pasted is not u and pasted.name == 'u_2'
+    assert pasted.display_name == u.display_name
+
+    # pasting again reuses the tile added by the first paste
+    room.paste(0, 1, clip)
+    assert room.tile_at(1, 1) is pasted
+    assert len(room.tileset) == 3
+
+def test_overriding_a_shared_tile_is_undone_before_adding_it():
+    from game import Game
+    from history import TileReplace, TileShare
+    game = Game()
+    room = Room(4, 4)
+    room.shared_tiles = game.tileset
+    history = History()
+    room.listeners.append(history.room_changed)
+    shared = named_tile('shared')
+    room.add_tile(shared)
+    game.tileset.append(shared)
+    history.push(TileShare(game, room, shared))
+
+    other = Room(4, 4)
+    other.shared_tiles = game.tileset
+    other.add_tile(shared)
+    history.push(TileAdd(other, shared))
+    clone = shared.clone()
+    other.replace_tile(0, clone)
+    history.push(TileReplace(other, 0, shared, clone))
+
+    history.undo()
+    assert other.tileset == [shared]
+    history.undo()
+    assert other.tileset == []
+    history.undo()
+    assert game.tileset == []
+
+def test_undoing_a_tile_add_checks_its_code():
+    room = Room(4, 4)
+    history = History()
+    t = named_tile('t')
+    room.add_tile(t)
+    history.push(TileAdd(room, t))
+    room.add_tile(named_tile('u'))
+    try:
+        history.undo()
+        assert False
+    except ValueError:
+        pass
+    assert room.tileset[0] is t
+    assert history.can_undo()
@@ -0,0 +1,48 @@
+import random
+from array import array
+
+from chunks import ChunkedGrid
+from grid import CellIndex, Diff, Grid
+
+def brute_force(grid, value: int) -> list[tuple[int, int]]:
+    return sorted((x, y) for y in range(grid.height) for x, v in enumerate(grid.row(y)) if v == value)
+
+def check_index(grid):
+    rng = random.Random(5)
+    for i in range(grid.width * grid.height):
+        grid.set(i % grid.width, i // grid.width, rng.randrange(4))
+    index = CellIndex(grid)
+    for _ in range(200):
+        x, y = rng.randrange(grid.width), rng.randrange(grid.height)
+        value = rng.randrange(6)
+        old = grid.set(x, y, value)
+        index.update(Diff('paint', array('I', [y * grid.width + x]), array('H', [old]), array('H', [value])))
+    for value in range(6):
+        cells = brute_force(grid, value)
+        assert index.count(value) == len(cells)
+        assert sorted(index.positions(value)) == cells
+        assert (index.first(value) == -1) == (len(cells) == 0)
+
+def test_index_of_a_grid():
+    check_index(Grid(40, 30))
+
+def test_index_of_a_chunked_grid():
+    check_index(ChunkedGrid(40, 30, 16))
+
+def test_counting_doesnt_page_in_chunks():
+    grid = ChunkedGrid(256, 256, 64)
+    grid.set(1, 1, 3)
+    index = CellIndex(grid)
+    assert index.count(3) == 1
+    assert list(grid.chunks) == [(0, 0)]
+
+def test_positions_inside_a_rect():
+    from grid import Rect
+    for grid in [Grid(40, 30), ChunkedGrid(40, 30, 16)]:
+        rng = random.Random(7)
+        for i in range(grid.width * grid.height):
+            grid.set(i % grid.width, i // grid.width, rng.randrange(3))
+        index = CellIndex(grid)
+        rect = Rect(10, 5, 12, 9)
+        expected = [(x, y) for x, y in brute_force(grid, 1) if 10 <= x < 22 and 5 <= y < 14]
+        assert sorted(index.positions(1, rect)) == expected
@@ -0,0 +1,81 @@
+from bench.generate import generate
+from game import Game
+
+def test_saving_an_unchanged_lazy_project_reads_and_writes_no_rooms(tmp_path):
+    project = str(tmp_path / 'project')
+    assert generate(project, 20, 16, 16, 4, 1) is None
+    game = Game.load(project, cache=False)
+    game.bind_loaded()
+    game.layout_encoding = lambda: 'rle'
+    for room in game.rooms:
+        room.dirty = True
+    assert game.save(project) is None
+
+    for _ in range(2):
+        game = Game.load(project, lazy=True, cache=False)
+        game.bind_loaded()
+        assert game.save(project) is None
+        assert sum(room.is_loaded() for room in game.rooms) == 0
+        assert not any(p.endswith('.json') and 'rooms' in p for p in game.last_written)
+
+def test_saving_reads_no_rooms_of_an_unchanged_plain_project(tmp_path):
+    project = str(tmp_path / 'project')
+    assert generate(project, 20, 16, 16, 4, 1) is None
+    game = Game.load(project, lazy=True, cache=False)
+    game.bind_loaded()
+    assert game.save(project) is None
+    assert sum(room.is_loaded() for room in game.rooms) == 0
+
+def test_changing_the_encoding_of_a_lazy_project_rewrites_its_rooms(tmp_path):
+    project = str(tmp_path / 'project')
+    assert generate(project, 5, 16, 16, 4, 1) is None
+    game = Game.load(project, lazy=True, cache=False)
+    game.bind_loaded()
+    game.layout_encoding = lambda: 'rle'
+    assert game.save(project) is None
+    assert sum(p.endswith('.json') and 'rooms' in p for p in game.last_written) == 5
+
+    game = Game.load(project, cache=False)
+    assert all(room.encoding == 'rle' for room in game.rooms)
+
+def test_a_failed_save_leaves_the_rooms_to_be_saved_again(tmp_path):
+    from game import SaveFile
+    project = str(tmp_path / 'project')
+    assert generate(project, 3, 16, 16, 4, 1) is None
+    game = Game.load(project, cache=False)
+    game.bind_loaded()
+    room = game.rooms[0]
+    room.set_tile(0, 0, room.tileset[1])
+    plan = game.plan_save(project)
+    def fail(f):
+        raise UnicodeEncodeError('cp1252', 'é', 0, 1, 'character maps to <undefined>')
+    plan.files.insert(0, SaveFile(str(tmp_path / 'project' / 'broken.txt'), fail))
+    err = plan.run()
+    assert err is not None
+    plan.finish(err)
+    assert room.dirty
+
+def test_scripts_are_written_as_utf8(tmp_path):
+    project = str(tmp_path / 'project')
+    assert generate(project, 1, 16, 16, 4, 1) is None
+    game = Game.load(project, cache=False)
+    game.bind_loaded()
+    game.rooms[0].tileset[0].script = '-- café ✓\n'
+    game.rooms[0].dirty = True
+    assert game.save(project) is None
+
+    game = Game.load(project, cache=False)
+    assert game.rooms[0].tileset[0].script == '-- café ✓\n'
+
+def test_parallel_loads_match_serial_loads(tmp_path, monkeypatch):
+    import os
+    project = str(tmp_path / 'project')
+    assert generate(project, 6, 16, 16, 4, 2) is None
+    serial = Game.load(project, cache=False)
+    # decode on processes even on one core
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+    for cache in [False, True, True]:
+        parallel = Game.load(project, workers=2, cache=cache)
+        for a, b in zip(serial.rooms, parallel.rooms):
+            assert a.grid.data == b.grid.data
+            assert [t.defn for t in a.tileset] == [t.defn for t in b.tileset]
@@ -40,12 +40,21 @@ namespace Tiled {
             #region Room Loading
             result._rooms = new();
             HashSet<string> executedScripts = new();
+            // tiles shared by all rooms, their scripts are relative to the rooms directory like in room files
+            var shared = new List<Tile.JTile>();
+            if (manifest.Tileset is not null)
+            {
+                var tPath = Path.Join(path, manifest.Tileset);
+                var tileset = JsonConvert.DeserializeObject<List<Tile.JTile>>(File.ReadAllText(tPath));
+                if (tileset is null) throw new Exception("Failed to parse tileset " + tPath);
+                shared = tileset;
+            }
             foreach (var pair in manifest.Rooms)
             {
                 var rPath = Path.Join(path, pair.Value);
                 if (!File.Exists(rPath)) throw new Exception("Room file " + rPath + " doesn't exist");
                 var rText = File.ReadAllText(rPath);
-                result._rooms[pair.Key] = Room.FromJson(pair.Key, rText, result.LState, executedScripts, Directory.GetParent(rPath).FullName);
+                result._rooms[pair.Key] = Room.FromJson(pair.Key, rText, result.LState, executedScripts, Directory.GetParent(rPath).FullName, shared);
             }
             #endregion
             #region Starting Location
@@ -201,6 +210,8 @@ namespace Tiled {
             public JSpawn Spawn { get; set; }
             [JsonProperty("rooms", Required=Required.Always)]
             public Dictionary<string, string> Rooms { get; set; }
+            [JsonProperty("tileset")]
+            public string? Tileset { get; set; }
 
             public class JSpawn
             {
@@ -1,6 +1,9 @@
 ﻿using Newtonsoft.Json;
+using Newtonsoft.Json.Linq;
 using System;
 using System.Collections.Generic;
+using System.IO;
+using System.IO.Compression;
 using System.Linq;
 using System.Text;
 using System.Threading.Tasks;
@@ -30,36 +33,79 @@ namespace Tiled.Layout
             Tileset = tileset;
         }
 
-        public static Room FromJson(string roomName, string json, Lua lState, HashSet<string> executedScripts, string path)
+        public static Room FromJson(string roomName, string json, Lua lState, HashSet<string> executedScripts, string path, List<Tile.JTile> shared)
         {
             JRoom? result = JsonConvert.DeserializeObject<JRoom>(json);
             if (result is null) throw new Exception("Failed to parse room: " + json);
-            return result.Get(roomName, lState, executedScripts, path);
+            return result.Get(roomName, lState, executedScripts, path, shared);
         }
 
         class JRoom
         {
+            // version 1 rooms use one char per cell, version 2 rooms use CodeWidth chars per cell
+            // and may store the layout in a LayoutEncoding other than plain
+            [JsonProperty("version")]
+            public int Version { get; set; } = 1;
+
+            [JsonProperty("code_width")]
+            public int CodeWidth { get; set; } = 1;
+
+            // plain stores every cell code, rle stores each row as comma separated code*count runs,
+            // chunks stores the layout in the Chunks directory instead of the layout string
+            [JsonProperty("layout_encoding")]
+            public string LayoutEncoding { get; set; } = "plain";
+
+            // entries are either tiles or {"shared": index} references to the project tileset
             [JsonProperty("tileset", Required = Required.Always)]
-            public Dictionary<char, Tile.JTile> Tileset { get; set; }
+            public Dictionary<string, JObject> Tileset { get; set; }
+
+            private Dictionary<string, Tile.JTile> _tiles = new();
+
+            [JsonProperty("layout")]
+            public string? Layout { get; set; }
+
+            [JsonProperty("width")]
+            public int Width { get; set; }
 
-            [JsonProperty("layout", Required = Required.Always)]
-            public string Layout { get; set; }
+            [JsonProperty("height")]
+            public int Height { get; set; }
 
-            public Room Get(string roomName, Lua lState, HashSet<string> executedScripts, string path)
+            [JsonProperty("chunk_size")]
+            public int ChunkSize { get; set; }
+
+            [JsonProperty("chunks")]
+            public string? Chunks { get; set; }
+
+            public Room Get(string roomName, Lua lState, HashSet<string> executedScripts, string path, List<Tile.JTile> shared)
             {
-                var lines = Layout.Split("\n");
-                TileSlot[][] layout = new TileSlot[lines.Length][];
+                foreach (var pair in Tileset)
+                {
+                    var sharedIndex = pair.Value["shared"];
+                    _tiles[pair.Key] = sharedIndex is null ? pair.Value.ToObject<Tile.JTile>()! : shared[(int)sharedIndex];
+                }
+                if (Version < 1 || Version > 2) throw new Exception("Room " + roomName + " has unsupported version " + Version);
+                var codeWidth = Version == 1 ? 1 : CodeWidth;
+                var encoding = Version == 1 ? "plain" : LayoutEncoding;
+                if (encoding != "plain" && encoding != "rle" && encoding != "chunks") throw new Exception("Room " + roomName + " has unsupported layout encoding " + encoding);
+                if (encoding != "chunks" && Layout is null) throw new Exception("Room " + roomName + " has no layout");
+                var lines = encoding == "chunks" ? new string[0] : Layout!.Split("\n");
+                TileSlot[][] layout = encoding == "chunks" ? ReadChunks(lState, executedScripts, path) : new TileSlot[lines.Length][];
 
                 for (int i = 0; i < lines.Length; i++)
                 {
-                    layout[i] = new TileSlot[lines[i].Length];
-                    for (int ii = 0; ii < lines[i].Length; ii++)
+                    if (encoding == "rle")
+                    {
+                        layout[i] = DecodeRleRow(lines[i], lState, executedScripts, path);
+                        continue;
+                    }
+                    layout[i] = new TileSlot[lines[i].Length / codeWidth];
+                    for (int ii = 0; ii < layout[i].Length; ii++)
                     {
-                        layout[i][ii] = new(Tileset[lines[i][ii]].Get(lState, executedScripts, path));
+                        layout[i][ii] = new(_tiles[lines[i].Substring(ii * codeWidth, codeWidth)].Get(lState, executedScripts, path));
                     }
                 }
                 var tSet = new Dictionary<string, Tile>();
-                foreach (var tile in Tileset.Values)
+                foreach (var tile in _tiles.Values)
                 {
                     tSet[tile.Name] = tile.Get(lState, executedScripts, path);
                 }
@@ -67,6 +113,58 @@ namespace Tiled.Layout
 
                 return result;
             }
+
+            // chunk files hold the zlib compressed little endian uint16 codes of a ChunkSize square,
+            // code n being the n-th tileset entry, chunks without a file are never saved
+            private TileSlot[][] ReadChunks(Lua lState, HashSet<string> executedScripts, string path)
+            {
+                var tiles = _tiles.Values.ToArray();
+                var layout = new TileSlot[Height][];
+                for (int y = 0; y < Height; y++)
+                    layout[y] = new TileSlot[Width];
+                var dir = Path.Combine(path, Chunks!);
+                for (int cy = 0; cy * ChunkSize < Height; cy++)
+                {
+                    for (int cx = 0; cx * ChunkSize < Width; cx++)
+                    {
+                        var w = Math.Min(ChunkSize, Width - cx * ChunkSize);
+                        var h = Math.Min(ChunkSize, Height - cy * ChunkSize);
+                        var data = new byte[w * h * 2];
+                        using (var file = File.OpenRead(Path.Combine(dir, cx + "_" + cy + ".bin")))
+                        using (var zlib = new ZLibStream(file, CompressionMode.Decompress))
+                        {
+                            var read = 0;
+                            while (read < data.Length)
+                            {
+                                var n = zlib.Read(data, read, data.Length - read);
+                                if (n == 0) throw new Exception("Chunk " + cx + "_" + cy + " of room is truncated");
+                                read += n;
+                            }
+                        }
+                        for (int i = 0; i < w * h; i++)
+                        {
+                            var code = data[i * 2] | (data[i * 2 + 1] << 8);
+                            layout[cy * ChunkSize + i / w][cx * ChunkSize + i % w] = new(tiles[code - 1].Get(lState, executedScripts, path));
+                        }
+                    }
+                }
+                return layout;
+            }
+
+            private TileSlot[] DecodeRleRow(string line, Lua lState, HashSet<string> executedScripts, string path)
+            {
+                var result = new List<TileSlot>();
+                if (line.Length == 0) return result.ToArray();
+                foreach (var run in line.Split(","))
+                {
+                    var parts = run.Split("*");
+                    var count = parts.Length > 1 ? int.Parse(parts[1]) : 1;
+                    var tile = _tiles[parts[0]];
+                    for (int i = 0; i < count; i++)
+                        result.Add(new(tile.Get(lState, executedScripts, path)));
+                }
+                return result.ToArray();
+            }
         }
     }
 }